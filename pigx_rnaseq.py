@@ -24,12 +24,17 @@ Snakefile for pigx rnaseq pipeline
 """
 
 import os
-import yaml
-import csv
-import inspect
+import sys
+import json
+import shlex
+import hashlib
 
+# The included scripts import each other from the scripts folder.
+sys.path.insert(1, os.path.join(config['locations']['pkglibexecdir'], 'scripts'))
 include: os.path.join(config['locations']['pkglibexecdir'], 'scripts/validate_input.py')
-validate_config(config)
+include: os.path.join(config['locations']['pkglibexecdir'], 'scripts/resource_profiles.py')
+include: os.path.join(config['locations']['pkglibexecdir'], 'scripts/index_cache.py')
+SAMPLE_REGISTRY = validate_config(config)
 
 GENOME_FASTA = config['locations']['genome-fasta']
 CDNA_FASTA = config['locations']['cdna-fasta']
@@ -43,6 +48,7 @@ else:
     LOGO = os.path.join(config['locations']['pkgdatadir'], "Logo_PiGx.png")
 
 SCRIPTS_DIR = os.path.join(config['locations']['pkglibexecdir'], 'scripts/')
+import count_matrix
 
 TRIMMED_READS_DIR = os.path.join(OUTPUT_DIR, 'trimmed_reads')
 LOG_DIR           = os.path.join(OUTPUT_DIR, 'logs')
@@ -50,8 +56,26 @@ FASTQC_DIR        = os.path.join(OUTPUT_DIR, 'fastqc')
 MULTIQC_DIR       = os.path.join(OUTPUT_DIR, 'multiqc')
 MAPPED_READS_DIR  = os.path.join(OUTPUT_DIR, 'mapped_reads')
 BIGWIG_DIR      = os.path.join(OUTPUT_DIR, 'bigwig_files')
+COVERAGE_DIR    = os.path.join(OUTPUT_DIR, 'coverage')
 COUNTS_DIR  = os.path.join(OUTPUT_DIR, 'feature_counts')
 SALMON_DIR        = os.path.join(OUTPUT_DIR, 'salmon_output')
+DESEQ_MODELS_DIR  = os.path.join(OUTPUT_DIR, 'deseq_models')
+BENCHMARK_DIR     = os.path.join(OUTPUT_DIR, 'pigx_work', 'benchmarks')
+PERFORMANCE_DIR   = os.path.join(OUTPUT_DIR, 'performance')
+QC_MANIFEST_DIR   = os.path.join(OUTPUT_DIR, 'pigx_work', 'qc_manifest')
+
+# Count matrices are written as TSV files, in the compressed columnar
+# .cmat format (see scripts/count_matrix.py), or in both formats.
+# Internal consumers read the .cmat files unless only TSV is written.
+MATRIX_FORMAT = config['counting']['matrix_format']
+if MATRIX_FORMAT not in ['tsv', 'binary', 'both']:
+  raise Exception("ERROR: counting:matrix_format must be one of 'tsv', 'binary' or 'both'.")
+
+def matrix_files(tsv_file):
+  return count_matrix.matrix_files(tsv_file, MATRIX_FORMAT)
+
+def matrix_file(tsv_file):
+  return matrix_files(tsv_file)[-1]
 
 def toolArgs(name):
     if 'args' in config['tools'][name]:
@@ -69,16 +93,207 @@ STAR_EXEC_MAP    = tool('star_map')
 STAR_EXEC_INDEX  = tool('star_index')
 SALMON_EXEC  = tool('salmon')
 TRIM_GALORE_EXEC = tool('trim-galore')
+CUTADAPT_EXEC    = tool('cutadapt')
 SAMTOOLS_EXEC    = tool('samtools')
 HTSEQ_COUNT_EXEC = tool('htseq-count')
 GUNZIP_EXEC      = tool('gunzip')
 RSCRIPT_EXEC     = tool('Rscript')
+PYTHON_EXEC      = tool('python')
 SED_EXEC = tool('sed')
 
-STAR_INDEX_THREADS   = config['execution']['rules']['star_index']['threads']
-SALMON_INDEX_THREADS = config['execution']['rules']['salmon_index']['threads']
-STAR_MAP_THREADS     = config['execution']['rules']['star_map']['threads']
-SALMON_QUANT_THREADS = config['execution']['rules']['salmon_quant']['threads']
+# Every rule gets at least the "threads" configured for it in
+# execution:rules, and up to its "max_threads".  In local runs with
+# dynamic_threads, the cores given by execution:jobs are shared by the
+# jobs that can run at the same time: jobs run once per sample (the
+# many narrow jobs at the start of a run) get an equal share of the
+# cores for all samples, jobs run once for the project (indexing, and
+# the few wide jobs at the end) get up to all cores.  Snakemake never
+# runs jobs that need more than these cores in total.
+CORE_BUDGET = config['execution']['jobs']
+DYNAMIC_THREADS = config['execution'].get('dynamic_threads', True) and not config['execution']['submit-to-cluster']
+
+def job_threads(rule, per_sample=True):
+  rules_config = config['execution']['rules']
+  settings = rules_config.get(rule, rules_config['__default__'])
+  low = settings['threads']
+  high = max(low, settings.get('max_threads', low))
+  if not DYNAMIC_THREADS:
+    return low
+  width = min(len(SAMPLE_REGISTRY.names()), CORE_BUDGET) if per_sample else 1
+  return min(CORE_BUDGET, max(low, min(high, CORE_BUDGET // max(1, width))))
+
+STAR_INDEX_THREADS   = job_threads('star_index', per_sample=False)
+SALMON_INDEX_THREADS = job_threads('salmon_index', per_sample=False)
+STAR_MAP_THREADS     = job_threads('star_map')
+SALMON_QUANT_THREADS = job_threads('salmon_quant')
+COUNT_READS_THREADS  = job_threads('count_reads')
+SORT_BAM_THREADS     = job_threads('sort_bam')
+SORT_BAM_MEMORY      = config['execution']['rules']['sort_bam']['sort_memory_per_thread']
+INDEX_BAM_THREADS    = job_threads('index_bam')
+DESEQ_FIT_THREADS    = job_threads('deseq_fit', per_sample=False)
+
+def split_threads(rules, per_sample=True):
+  """Return the threads of the tools of RULES running together in one
+job: the job's share of the cores (as for job_threads), split between
+the tools in proportion to their own threads.  Every tool gets at least
+one thread, so with fewer cores than tools the job uses more cores than
+it was given."""
+  wanted = [job_threads(rule, per_sample) for rule in rules]
+  total = sum(wanted)
+  local = not config['execution']['submit-to-cluster']
+  if local:
+    width = min(len(SAMPLE_REGISTRY.names()), CORE_BUDGET) if DYNAMIC_THREADS and per_sample else 1
+    total = min(total, max(1, CORE_BUDGET // width))
+  parts = [max(1, w * total // sum(wanted)) for w in wanted]
+  while sum(parts) > total and max(parts) > 1:
+    parts[parts.index(max(parts))] -= 1
+  while sum(parts) < total:
+    parts[wanted.index(max(wanted))] += 1
+  if local and sum(parts) > CORE_BUDGET:
+    print("WARNING: {} run in one job with at least one thread each, more than the {} cores"
+          " given by \"jobs\".".format(', '.join(rules), CORE_BUDGET), file=sys.stderr)
+  return parts
+
+# star_map piping into samtools sort, and trim_map_quant
+STREAM_MAP_THREADS, STREAM_SORT_THREADS = split_threads(['star_map', 'sort_bam'])
+TRIM_THREADS, TRIM_MAP_THREADS, TRIM_SORT_THREADS, TRIM_QUANT_THREADS = \
+  split_threads(['trim_map_quant', 'star_map', 'sort_bam', 'salmon_quant'])
+
+STREAM_TRIMMING    = config['execution']['stream_trimming']['enabled']
+KEEP_TRIMMED_READS = config['execution']['stream_trimming']['keep_trimmed_reads']
+ADAPTER            = config['execution']['stream_trimming']['adapter']
+FAN_OUT_BUFFER     = memory_mb(config['execution']['stream_trimming'].get('buffer', '512M'))
+
+# In local runs the launcher can load the STAR genome index into shared
+# memory once; star_map jobs then attach to it and need much less
+# memory of their own.
+STAR_SHARED_GENOME = config['execution']['star_shared_genome'] and not config['execution']['submit-to-cluster']
+if STAR_SHARED_GENOME:
+  STAR_GENOME_LOAD = "--genomeLoad LoadAndKeep"
+  STAR_MAP_MEMORY  = memory_mb(config['execution']['rules']['star_map']['shared_genome_memory'])
+else:
+  STAR_GENOME_LOAD = ""
+  STAR_MAP_MEMORY  = memory_mb(config['execution']['rules']['star_map']['memory'])
+
+# The memory of every per-sample job is predicted from the resource
+# profiles learned from earlier runs (see resource_profiles.py), scaled
+# by the size of the sample's reads files.  Rules run once per project
+# (indexes, annotation, DESeq2 and reports) depend on the size of the
+# genome, annotation or count matrices instead, and like rules without
+# a profile they get the memory configured in execution:rules.  Jobs that are restarted
+# after a failure (e.g. when killed for exceeding their memory) ask
+# for MEMORY_ESCALATION times more memory on every attempt.  The
+# rules attaching to the shared STAR genome are neither profiled nor
+# predicted: their peak RSS includes the pages of the shared genome.
+RESOURCE_PROFILES = config['execution'].get('resource_profiles', {})
+RESOURCE_PROFILES_FILE = RESOURCE_PROFILES.get('file') or os.path.join(OUTPUT_DIR, 'pigx_work', 'resource_profiles.json')
+LEARNED_PROFILES = read_profiles(RESOURCE_PROFILES_FILE) if RESOURCE_PROFILES.get('enabled') else {}
+MEMORY_ESCALATION = config['execution'].get('memory_escalation', 1.5)
+UNPROFILED_RULES = ['star_map', 'trim_map_quant'] if STAR_SHARED_GENOME else []
+
+LOCAL_MEMORY = None
+if config['execution']['local_memory'] and not config['execution']['submit-to-cluster']:
+  LOCAL_MEMORY = memory_mb(config['execution']['local_memory'])
+
+# Size of the reads files of the sample TARGET, or None for targets
+# that are not samples of the sample sheet.
+INPUT_BYTES = {}
+def job_input_bytes(rule, target):
+  if target not in SAMPLE_REGISTRY:
+    return None
+  if target not in INPUT_BYTES:
+    INPUT_BYTES[target] = sum(os.path.getsize(f) for f in SAMPLE_REGISTRY[target].read_paths)
+  return INPUT_BYTES[target]
+
+def job_memory(rule, default=None):
+  rules_config = config['execution']['rules']
+  configured = default if default is not None else memory_mb(rules_config.get(rule, rules_config['__default__'])['memory'])
+  def memory(wildcards, attempt):
+    learned = None
+    size = job_input_bytes(rule, getattr(wildcards, 'sample', None))
+    if rule not in UNPROFILED_RULES and size is not None:
+      learned = predict_memory(LEARNED_PROFILES, rule, size,
+                               RESOURCE_PROFILES.get('margin', 0.2),
+                               RESOURCE_PROFILES.get('min_observations', 3))
+    if config['execution']['submit-to-cluster']:
+      # mem_mb sets h_vmem, a limit on virtual memory, which is far above
+      # the resident memory of Java, R and STAR; the configured memory
+      # stays the floor
+      learned = max(learned or 0, configured)
+    needed = int((learned or configured) * MEMORY_ESCALATION ** (attempt - 1))
+    if LOCAL_MEMORY and needed > LOCAL_MEMORY:
+      # such a job would never be started: run it alone with all of
+      # the local memory instead
+      print("WARNING: a {} job needs {} MB, more than the local memory of {} MB;"
+            " it will run alone with {} MB.".format(rule, needed, LOCAL_MEMORY, LOCAL_MEMORY), file=sys.stderr)
+      return LOCAL_MEMORY
+    return needed
+  return memory
+
+# On the cluster, short per-sample steps can be bundled into fewer
+# jobs.  Connected steps of rules assigned to the same group in
+# execution:cluster:bundle:groups run in one cluster job, e.g. the
+# sorting, indexing, FastQC and read counting of a sample; the
+# launcher's --group-components option puts up to components_per_job
+# of these per-sample components into each job.  Every bundled step
+# appends its exit status to a status file of its sample in
+# STEP_STATUS_DIR.
+BUNDLABLE_RULES = ['trim_galore_pe', 'trim_galore_se', 'sort_bam', 'index_bam',
+                   'fastqc', 'count_reads', 'genomeCoverage']
+BUNDLE_GROUPS = {rule_name: group for rule_name, group in
+                 (config['execution']['cluster'].get('bundle', {}).get('groups') or {}).items() if group}
+for rule_name in BUNDLE_GROUPS:
+  if rule_name not in BUNDLABLE_RULES:
+    raise Exception("ERROR: rule {} cannot be bundled; only these rules can: {}".format(rule_name, ', '.join(BUNDLABLE_RULES)))
+if not config['execution']['submit-to-cluster']:
+  BUNDLE_GROUPS = {}
+STEP_STATUS_DIR = os.path.join(LOG_DIR, 'bundles')
+
+def job_group(rule):
+  return BUNDLE_GROUPS.get(rule)
+
+def bundle_step(rule, command):
+  if rule not in BUNDLE_GROUPS:
+    return command
+  status_file = os.path.join(STEP_STATUS_DIR, '{wildcards.sample}.status.tsv')
+  return ("mkdir -p " + STEP_STATUS_DIR + " && ( " + command + " ) && status=0 || status=$?; " +
+          "printf '%s\\t%s\\t%s\\n' \"$(date '+%Y-%m-%d %H:%M:%S')\" " + rule + " $status >> " + status_file +
+          "; exit $status")
+
+# Intermediate files (trimmed reads and unsorted BAM files) are removed
+# as soon as all jobs using them have finished, if remove_intermediates
+# is set.  With a scratch_dir (e.g. node-local /tmp or $TMPDIR), the
+# mapping, sorting and quantification jobs work in a folder of their
+# own in it, and only their results are copied to the output folder.
+# These jobs and the trimming jobs reserve disk_per_input times the
+# size of the sample's reads files of the disk_mb resource, which the
+# launcher limits to disk_budget.
+STORAGE = config['execution']['storage']
+SCRATCH_DIR = STORAGE['scratch_dir']
+
+def intermediate(path):
+  return temp(path) if STORAGE['remove_intermediates'] else path
+
+def work_dir(rule, final_dir):
+  if SCRATCH_DIR:
+    return os.path.join(SCRATCH_DIR, 'pigx_rnaseq', rule, '{sample}')
+  return final_dir
+
+def staged(command, moves):
+  """Run COMMAND in the scratch folder {params.work}, then copy the files
+matching each pattern of the (pattern, folder) pairs in MOVES to the
+folder.  The scratch folder is removed in any case."""
+  if not SCRATCH_DIR:
+    return command
+  copies = " && ".join("mkdir -p {1} && cp -r {{params.work}}/{0} {1}/".format(pattern, folder)
+                       for pattern, folder in moves)
+  return ("rm -rf {params.work} && mkdir -p {params.work} && ( " + command + " && " + copies +
+          " ) && status=0 || status=$?; rm -rf {params.work}; exit $status")
+
+def job_disk(rule):
+  def disk_mb(wildcards):
+    return int(job_input_bytes(rule, wildcards.sample) * STORAGE['disk_per_input'] / (1024 * 1024)) + 1
+  return disk_mb
 
 
 GTF_FILE = config['locations']['gtf-file']
@@ -86,22 +301,36 @@ SAMPLE_SHEET_FILE = config['locations']['sample-sheet']
 
 DE_ANALYSIS_LIST = config.get('DEanalyses', {})
 
-## Load sample sheet
-with open(SAMPLE_SHEET_FILE, 'r') as fp:
-  rows =  [row for row in csv.reader(fp, delimiter=',')]
-  header = rows[0]; rows = rows[1:]
-  SAMPLE_SHEET = [dict(zip(header, row)) for row in rows]
+# DESeq2 models are fitted once per count matrix and design, and shared
+# by all analyses with the same case and control groups and covariates.
+def deseq_model_key(analysis):
+  spec = DE_ANALYSIS_LIST[analysis]
+  groups = lambda field: sorted(g.strip() for g in spec[field].split(',') if g.strip())
+  design = [groups('case_sample_groups'), groups('control_sample_groups'),
+            [c.strip() for c in (spec.get('covariates') or '').split(',') if c.strip()]]
+  return hashlib.md5(json.dumps(design).encode()).hexdigest()[:16]
+
+DESEQ_MODELS = {}
+for analysis in DE_ANALYSIS_LIST:
+  DESEQ_MODELS.setdefault(deseq_model_key(analysis), DE_ANALYSIS_LIST[analysis])
+
+def deseq_model_file(source):
+  return lambda wildcards: os.path.join(DESEQ_MODELS_DIR, '{}.{}.rds'.format(source, deseq_model_key(wildcards.analysis)))
 
-# Convenience function to access fields of sample sheet columns that
-# match the predicate.  The predicate may be a string.
-def lookup(column, predicate, fields=[]):
-  if inspect.isfunction(predicate):
-    records = [line for line in SAMPLE_SHEET if predicate(line[column])]
-  else:
-    records = [line for line in SAMPLE_SHEET if line[column]==predicate]
-  return [record[field] for record in records for field in fields]
+# Checksums of reference files are cached in CHECKSUM_CACHE_DIR by
+# path, size and modification time, so that large files are only
+# hashed once (see file_checksum in index_cache.py).
+CHECKSUM_CACHE_DIR = os.path.join(OUTPUT_DIR, 'pigx_work')
+os.makedirs(CHECKSUM_CACHE_DIR, exist_ok=True)
 
-SAMPLES = [line['name'] for line in SAMPLE_SHEET]
+# The GTF file is compiled once into a binary annotation file, which
+# is keyed by the GTF checksum and the counting settings.
+ANNOTATION_KEY = hashlib.md5('{}:{}:{}'.format(file_checksum(GTF_FILE, CHECKSUM_CACHE_DIR),
+                                               config['counting']['feature'],
+                                               config['counting']['group_feature_by']).encode()).hexdigest()
+ANNOTATION_FILE = os.path.join(OUTPUT_DIR, 'annotation', 'annotation.{}.rds'.format(ANNOTATION_KEY[:16]))
+
+SAMPLES = SAMPLE_REGISTRY.names()
 
 targets = {
     # rule to print all rule descriptions
@@ -115,13 +344,13 @@ targets = {
       [os.path.join(OUTPUT_DIR, 'star_index', "SAindex"),
             os.path.join(OUTPUT_DIR, 'salmon_index', "sa.bin"),
             os.path.join(MULTIQC_DIR, 'multiqc_report.html')] +
-	  [os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv"),
-            os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv"),
-            os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.transcripts.tsv"),
-            os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.genes.tsv"),
-            os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv"),
-            os.path.join(COUNTS_DIR, "normalized", "deseq_normalized_counts.tsv",
-            os.path.join(COUNTS_DIR, "normalized", "deseq_size_factors.txt"))] +
+	  matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.transcripts.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.genes.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "normalized", "deseq_normalized_counts.tsv")) +
+          [os.path.join(COUNTS_DIR, "normalized", "deseq_size_factors.txt")] +
 	  expand(os.path.join(BIGWIG_DIR, '{sample}.forward.bigwig'), sample = SAMPLES) +
       expand(os.path.join(BIGWIG_DIR, '{sample}.reverse.bigwig'), sample = SAMPLES) +
       expand(os.path.join(OUTPUT_DIR, "report", '{analysis}.star.deseq.report.html'), analysis = DE_ANALYSIS_LIST.keys()) +
@@ -151,7 +380,7 @@ targets = {
     'star_counts': {
         'description': "Get count matrix from STAR mapping results using summarizeOverlaps.",
         'files':
-          [os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv")]
+          matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv"))
     },
     'genome_coverage': {
         'description': "Compute genome coverage values from BAM files - save in bigwig format",
@@ -178,13 +407,13 @@ targets = {
     'salmon_counts': {
         'description': "Get count matrix from SALMON quant.",
         'files':
-          [os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv"),
-	   os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv"),
-	   os.path.join(COUNTS_DIR, "normalized",  "TPM_counts_from_SALMON.transcripts.tsv"),
-	   os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.genes.tsv")]
+          matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.transcripts.tsv")) +
+          matrix_files(os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.genes.tsv"))
     },
     'multiqc': {
-        'description': "Get multiQC report based on STAR alignments and fastQC reports.",
+        'description': "Get multiQC report based on the trimming reports, STAR and SALMON logs and fastQC reports.",
         'files':
           [os.path.join(MULTIQC_DIR, 'multiqc_report.html')]
     }
@@ -227,45 +456,96 @@ onsuccess:
             print("The following files have been generated:")
             for name in generated:
                 print("  - {}".format(name))
+    # summarize the resources used by all jobs (see the benchmark
+    # directive of the rules)
+    if os.path.isdir(BENCHMARK_DIR):
+        shell("{PYTHON_EXEC} {SCRIPTS_DIR}/summarize_benchmarks.py {BENCHMARK_DIR} {PERFORMANCE_DIR}")
+        if RESOURCE_PROFILES.get('enabled'):
+            update_profiles(RESOURCE_PROFILES_FILE, BENCHMARK_DIR, job_input_bytes,
+                            skip_rules=UNPROFILED_RULES)
 
 
 rule translate_sample_sheet_for_report:
   input: SAMPLE_SHEET_FILE
   output: os.path.join(os.getcwd(), "colData.tsv")
+  resources:
+    mem_mb = job_memory('translate_sample_sheet_for_report')
+  benchmark: os.path.join(BENCHMARK_DIR, 'translate_sample_sheet_for_report.tsv')
   shell: "{RSCRIPT_EXEC} {SCRIPTS_DIR}/translate_sample_sheet_for_report.R {input}"
 
 # determine if the sample library is single end or paired end
 def isSingleEnd(args):
-  sample = args[0]
-  files = lookup('name', sample, ['reads', 'reads2'])
-  count = sum(1 for f in files if f)
-  if count == 2:
-      return False
-  elif count == 1:
-      return True
+  return SAMPLE_REGISTRY[args[0]].single_end
 
 def trim_galore_input(args):
-  sample = args[0]
-  return [os.path.join(READS_DIR, f) for f in lookup('name', sample, ['reads', 'reads2']) if f]
+  return SAMPLE_REGISTRY[args[0]].read_paths
 
-rule trim_galore_pe:
-  input: trim_galore_input
-  output:
-    r1=os.path.join(TRIMMED_READS_DIR, "{sample}_R1.fastq.gz"),
-    r2=os.path.join(TRIMMED_READS_DIR, "{sample}_R2.fastq.gz")
+# Unless trimmed reads are streamed (see trim_map_quant), Trim Galore
+# writes them to TRIMMED_READS_DIR.
+if not STREAM_TRIMMING:
+  rule trim_galore_pe:
+    input: trim_galore_input
+    output:
+      r1=intermediate(os.path.join(TRIMMED_READS_DIR, "{sample}_R1.fastq.gz")),
+      r2=intermediate(os.path.join(TRIMMED_READS_DIR, "{sample}_R2.fastq.gz"))
+    params:
+      tmp1=lambda wildcards, output: os.path.join(TRIMMED_READS_DIR, SAMPLE_REGISTRY.get(wildcards[0], 'reads')).replace('.fastq.gz','_val_1.fq.gz'),
+      tmp2=lambda wildcards, output: os.path.join(TRIMMED_READS_DIR, SAMPLE_REGISTRY.get(wildcards[0], 'reads2')).replace('.fastq.gz','_val_2.fq.gz')
+    log: os.path.join(LOG_DIR, 'trim_galore_{sample}.log')
+    group: job_group('trim_galore_pe')
+    resources:
+      mem_mb = job_memory('trim_galore_pe'),
+      disk_mb = job_disk('trim_galore_pe')
+    benchmark: os.path.join(BENCHMARK_DIR, 'trim_galore_pe', '{sample}.tsv')
+    shell: bundle_step('trim_galore_pe', "{TRIM_GALORE_EXEC} -o {TRIMMED_READS_DIR} --paired {input[0]} {input[1]} >> {log} 2>&1 && sleep 10 && mv {params.tmp1} {output.r1} && mv {params.tmp2} {output.r2}")
+
+  rule trim_galore_se:
+    input: trim_galore_input
+    output: intermediate(os.path.join(TRIMMED_READS_DIR, "{sample}_R.fastq.gz")),
+    params: tmp=lambda wildcards, output: os.path.join(TRIMMED_READS_DIR, SAMPLE_REGISTRY.get(wildcards[0], 'reads')).replace('.fastq.gz','_trimmed.fq.gz'),
+    log: os.path.join(LOG_DIR, 'trim_galore_{sample}.log')
+    group: job_group('trim_galore_se')
+    resources:
+      mem_mb = job_memory('trim_galore_se'),
+      disk_mb = job_disk('trim_galore_se')
+    benchmark: os.path.join(BENCHMARK_DIR, 'trim_galore_se', '{sample}.tsv')
+    shell: bundle_step('trim_galore_se', "{TRIM_GALORE_EXEC} -o {TRIMMED_READS_DIR} {input[0]} >> {log} 2>&1 && sleep 10 && mv {params.tmp} {output}")
+
+
+rule compile_annotation:
+  input: GTF_FILE
+  output: ANNOTATION_FILE
   params:
-    tmp1=lambda wildcards, output: os.path.join(TRIMMED_READS_DIR, lookup('name', wildcards[0], ['reads'])[0]).replace('.fastq.gz','_val_1.fq.gz'),
-    tmp2=lambda wildcards, output: os.path.join(TRIMMED_READS_DIR, lookup('name', wildcards[0], ['reads2'])[0]).replace('.fastq.gz','_val_2.fq.gz')
-  log: os.path.join(LOG_DIR, 'trim_galore_{sample}.log')
-  shell: "{TRIM_GALORE_EXEC} -o {TRIMMED_READS_DIR} --paired {input[0]} {input[1]} >> {log} 2>&1 && sleep 10 && mv {params.tmp1} {output.r1} && mv {params.tmp2} {output.r2}"
+    feature = config['counting']['feature'],
+    group_by = config['counting']['group_feature_by']
+  log: os.path.join(LOG_DIR, 'compile_annotation.log')
+  resources:
+    mem_mb = job_memory('compile_annotation')
+  benchmark: os.path.join(BENCHMARK_DIR, 'compile_annotation.tsv')
+  shell: "{RSCRIPT_EXEC} {SCRIPTS_DIR}/compile_annotation.R {input} {params.feature} {params.group_by} {output} >> {log} 2>&1"
+
 
-rule trim_galore_se:
-  input: trim_galore_input
-  output: os.path.join(TRIMMED_READS_DIR, "{sample}_R.fastq.gz"),
-  params: tmp=lambda wildcards, output: os.path.join(TRIMMED_READS_DIR, lookup('name', wildcards[0], ['reads'])[0]).replace('.fastq.gz','_trimmed.fq.gz'),
-  log: os.path.join(LOG_DIR, 'trim_galore_{sample}.log')
-  shell: "{TRIM_GALORE_EXEC} -o {TRIMMED_READS_DIR} {input[0]} >> {log} 2>&1 && sleep 10 && mv {params.tmp} {output}"
+# Genome indexes are built in (or reused from) a shared cache folder
+# when "index-cache-dir" is set in the locations section.  Cache
+# entries are keyed by the checksums of the KEY_FILES, the output of
+# the VERSION_COMMAND and the index arguments in KEY_STRING.  The
+# BUILD_COMMAND must build the index in @INDEX_DIR@.
+INDEX_CACHE_DIR = config['locations'].get('index-cache-dir', '')
 
+def cached_index_command(name, key_files, key_string, version_command, build_command):
+  target = os.path.join(OUTPUT_DIR, name)
+  if not INDEX_CACHE_DIR:
+    return build_command.replace('@INDEX_DIR@', target)
+  # quoted for the shell, with braces escaped for Snakemake
+  quote = lambda value: shlex.quote(value).replace('{', '{{').replace('}', '}}')
+  return ("{PYTHON_EXEC} {SCRIPTS_DIR}/index_cache.py" +
+          " --cache-dir " + quote(INDEX_CACHE_DIR) +
+          " --name " + quote(name) +
+          " --target " + quote(target) +
+          "".join(" --key-file " + quote(f) for f in key_files) +
+          " --key-string " + quote(key_string) +
+          " --version-command " + quote(version_command) + " -- " +
+          build_command.replace('@INDEX_DIR@', '{{index_dir}}'))
 
 rule star_index:
     input: GENOME_FASTA
@@ -274,48 +554,215 @@ rule star_index:
     params:
         star_index_dir = os.path.join(OUTPUT_DIR, 'star_index')
     log: os.path.join(LOG_DIR, 'star_index.log')
-    shell: "{STAR_EXEC_INDEX} --runMode genomeGenerate --runThreadN {STAR_INDEX_THREADS} --genomeDir {params.star_index_dir} --genomeFastaFiles {input} --sjdbGTFfile {GTF_FILE} >> {log} 2>&1"
+    threads: STAR_INDEX_THREADS
+    resources:
+        mem_mb = job_memory('star_index')
+    benchmark: os.path.join(BENCHMARK_DIR, 'star_index.tsv')
+    shell: cached_index_command('star_index', [GENOME_FASTA, GTF_FILE], toolArgs('star_index'),
+                                config['tools']['star_index']['executable'] + " --version",
+                                "{STAR_EXEC_INDEX} --runMode genomeGenerate --runThreadN {STAR_INDEX_THREADS} --genomeDir @INDEX_DIR@ --genomeFastaFiles {input} --sjdbGTFfile {GTF_FILE}") + " >> {log} 2>&1"
 
 def map_input(args):
   sample = args[0]
-  reads_files = [os.path.join(READS_DIR, f) for f in lookup('name', sample, ['reads', 'reads2']) if f]
+  reads_files = SAMPLE_REGISTRY[sample].read_paths
   if len(reads_files) > 1:
     return [os.path.join(TRIMMED_READS_DIR, "{sample}_R1.fastq.gz".format(sample=sample)), os.path.join(TRIMMED_READS_DIR, "{sample}_R2.fastq.gz".format(sample=sample))]
   elif len(reads_files) == 1:
     return [os.path.join(TRIMMED_READS_DIR, "{sample}_R.fastq.gz".format(sample=sample))]
 
-rule star_map:
-  input:
-    # This rule really depends on the whole directory (see
-    # params.index_dir), but we can't register it as an input/output
-    # in its own right since Snakemake 5.
-    index_file = rules.star_index.output.star_index_file,
-    reads = map_input
-  output:
-    os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.out.bam')
-  params:
-    index_dir = rules.star_index.params.star_index_dir,
-    output_prefix=os.path.join(MAPPED_READS_DIR, '{sample}_')
-  log: os.path.join(LOG_DIR, 'star_map_{sample}.log')
-  shell: "{STAR_EXEC_MAP} --runThreadN {STAR_MAP_THREADS} --genomeDir {params.index_dir} --readFilesIn {input.reads} --readFilesCommand '{GUNZIP_EXEC} -c' --outSAMtype BAM Unsorted --outFileNamePrefix {params.output_prefix} >> {log} 2>&1"
+if STREAM_TRIMMING:
+  # The reads are trimmed once by cutadapt and fed through named pipes
+  # to STAR and SALMON, which run concurrently; fan_out_reads.py splits
+  # paired reads by mate and buffers what one reader takes ahead of
+  # the other (see FAN_OUT_BUFFER).  STAR writes the unsorted
+  # alignments to stdout, which are sorted in the same job.
+  # This replaces the rules trim_galore_pe/se, star_map (with sort_bam)
+  # and salmon_quant.
+  rule trim_map_quant:
+    input:
+      # These indexes really are whole directories (see
+      # params.star_index_dir and params.salmon_index_dir).
+      star_index_file = rules.star_index.output.star_index_file,
+      salmon_index_file = os.path.join(OUTPUT_DIR, 'salmon_index', "sa.bin"),
+      reads = trim_galore_input
+    output:
+      bam = os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam'),
+      quant = os.path.join(SALMON_DIR, "{sample}", "quant.sf"),
+      quant_genes = os.path.join(SALMON_DIR, "{sample}", "quant.genes.sf"),
+      report = os.path.join(TRIMMED_READS_DIR, "{sample}_trimming_report.txt")
+    params:
+      star_index_dir = rules.star_index.params.star_index_dir,
+      salmon_index_dir = os.path.join(OUTPUT_DIR, 'salmon_index'),
+      work = work_dir('trim_map_quant', MAPPED_READS_DIR),
+      output_prefix = os.path.join(work_dir('trim_map_quant', MAPPED_READS_DIR), '{sample}_'),
+      sort_tmp = os.path.join(work_dir('trim_map_quant', MAPPED_READS_DIR), '{sample}_sort_tmp'),
+      salmon_work = os.path.join(work_dir('trim_map_quant', MAPPED_READS_DIR), 'salmon') if SCRATCH_DIR else os.path.join(SALMON_DIR, "{sample}"),
+      salmon_outfolder = os.path.join(SALMON_DIR, "{sample}"),
+      fifos = os.path.join(OUTPUT_DIR, 'pigx_work', 'fifos', '{sample}')
+    log:
+      star = os.path.join(LOG_DIR, 'star_map_{sample}.log'),
+      salmon = os.path.join(LOG_DIR, 'salmon_quant_{sample}.log')
+    threads: TRIM_THREADS + TRIM_MAP_THREADS + TRIM_SORT_THREADS + TRIM_QUANT_THREADS
+    resources:
+      mem_mb = job_memory('trim_map_quant', memory_mb(config['execution']['rules']['trim_map_quant']['memory']) + FAN_OUT_BUFFER +
+                          STAR_MAP_MEMORY + memory_mb(config['execution']['rules']['salmon_quant']['memory'])),
+      disk_mb = job_disk('trim_map_quant')
+    benchmark: os.path.join(BENCHMARK_DIR, 'trim_map_quant', '{sample}.tsv')
+    run:
+      fifos = params.fifos
+      if len(input.reads) == 2:
+        TRIM_COMMAND = "{CUTADAPT_EXEC} -j {TRIM_THREADS} -a {ADAPTER} -A {ADAPTER} --interleaved -o - {input.reads[0]} {input.reads[1]}"
+        FIFOS = "{fifos}/star_R1 {fifos}/star_R2 {fifos}/salmon_R1 {fifos}/salmon_R2"
+        FAN_OUT = "-1 {fifos}/star_R1 {fifos}/salmon_R1 -2 {fifos}/star_R2 {fifos}/salmon_R2"
+        STAR_READS = "{fifos}/star_R1 {fifos}/star_R2"
+        SALMON_READS = "-1 {fifos}/salmon_R1 -2 {fifos}/salmon_R2"
+        KEEP = [os.path.join(TRIMMED_READS_DIR, wildcards.sample + "_R1.fastq.gz"),
+                os.path.join(TRIMMED_READS_DIR, wildcards.sample + "_R2.fastq.gz")]
+      else:
+        TRIM_COMMAND = "{CUTADAPT_EXEC} -j {TRIM_THREADS} -a {ADAPTER} -o - {input.reads[0]}"
+        FIFOS = "{fifos}/star_R1 {fifos}/salmon_R1"
+        FAN_OUT = "-1 {fifos}/star_R1 {fifos}/salmon_R1"
+        STAR_READS = "{fifos}/star_R1"
+        SALMON_READS = "-r {fifos}/salmon_R1"
+        KEEP = [os.path.join(TRIMMED_READS_DIR, wildcards.sample + "_R.fastq.gz")]
+      if KEEP_TRIMMED_READS:
+        FAN_OUT += "".join(" --keep{} {}".format(mate + 1, path) for mate, path in enumerate(KEEP))
+      shell("rm -rf {fifos} {params.output_prefix}_STARtmp && mkdir -p {fifos} {TRIMMED_READS_DIR} && mkfifo " + FIFOS)
+      # STAR, SALMON and the trimming run as background jobs.  As soon
+      # as one of them fails it stops the job, and the others are
+      # killed (a writer blocked on opening a FIFO whose reader has died
+      # would wait forever); the FIFOs are removed in any case.  The job
+      # succeeds only if all three exit with status 0.
+      shell(staged("set -o pipefail; main=$BASHPID; star=; salmon=; trim=; " +
+            "killtree() {{ for child in $(pgrep -P $1); do killtree $child; done; kill $1 2>/dev/null || true; }}; " +
+            "trap 'for job in $star $salmon $trim; do killtree $job; done; rm -rf {fifos}' EXIT; trap 'exit 1' TERM; " +
+            "{{ ( {STAR_EXEC_MAP} --runThreadN {TRIM_MAP_THREADS} --genomeDir {params.star_index_dir} {STAR_GENOME_LOAD} --readFilesIn " + STAR_READS +
+            " --outSAMtype BAM Unsorted --outStd BAM_Unsorted --outFileNamePrefix {params.output_prefix} 2>> {log.star}" +
+            " | {SAMTOOLS_EXEC} sort -@ {TRIM_SORT_THREADS} -m {SORT_BAM_MEMORY} -T {params.sort_tmp} -o {params.output_prefix}Aligned.sortedByCoord.out.bam - >> {log.star} 2>&1 ) || {{ kill $main; exit 1; }}; }} & star=$!; " +
+            "{{ {SALMON_EXEC} quant -i {params.salmon_index_dir} -l A -p {TRIM_QUANT_THREADS} " + SALMON_READS +
+            " -o {params.salmon_work} --seqBias --gcBias -g {GTF_FILE} >> {log.salmon} 2>&1 || {{ kill $main; exit 1; }}; }} & salmon=$!; " +
+            "{{ ( " + TRIM_COMMAND + " 2> {output.report} | {PYTHON_EXEC} {SCRIPTS_DIR}/fan_out_reads.py --buffer-mb {FAN_OUT_BUFFER} " + FAN_OUT +
+            " >> {log.star} 2>&1 ) || {{ kill $main; exit 1; }}; }} & trim=$!; " +
+            "status=0; for job in $star $salmon $trim; do wait $job || status=1; done; [ $status = 0 ]",
+            [("{wildcards.sample}_*", MAPPED_READS_DIR), ("salmon/*", "{params.salmon_outfolder}")]))
 
-rule sort_bam:
-  input: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.out.bam')
-  output: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam')
-  log: os.path.join(LOG_DIR, 'samtools_sort_{sample}.log')
-  shell: "{SAMTOOLS_EXEC} sort -o {output} {input} >> {log} 2>&1"
+elif config['execution']['stream_sort']:
+  # STAR writes the unsorted alignments to stdout, which are sorted in
+  # the same job without an intermediate BAM file.
+  rule star_map:
+    input:
+      # This rule really depends on the whole directory (see
+      # params.index_dir), but we can't register it as an input/output
+      # in its own right since Snakemake 5.
+      index_file = rules.star_index.output.star_index_file,
+      reads = map_input
+    output:
+      bam = os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam')
+    params:
+      index_dir = rules.star_index.params.star_index_dir,
+      work = work_dir('star_map', MAPPED_READS_DIR),
+      output_prefix=os.path.join(work_dir('star_map', MAPPED_READS_DIR), '{sample}_'),
+      sort_tmp=os.path.join(work_dir('star_map', MAPPED_READS_DIR), '{sample}_sort_tmp')
+    log: os.path.join(LOG_DIR, 'star_map_{sample}.log')
+    threads: STREAM_MAP_THREADS + STREAM_SORT_THREADS
+    resources:
+      mem_mb = job_memory('star_map', STAR_MAP_MEMORY),
+      disk_mb = job_disk('star_map')
+    benchmark: os.path.join(BENCHMARK_DIR, 'star_map', '{sample}.tsv')
+    shell: staged("rm -rf {params.output_prefix}_STARtmp && {STAR_EXEC_MAP} --runThreadN {STREAM_MAP_THREADS} --genomeDir {params.index_dir} {STAR_GENOME_LOAD} --readFilesIn {input.reads} --readFilesCommand '{GUNZIP_EXEC} -c' --outSAMtype BAM Unsorted --outStd BAM_Unsorted --outFileNamePrefix {params.output_prefix} 2>> {log} | {SAMTOOLS_EXEC} sort -@ {STREAM_SORT_THREADS} -m {SORT_BAM_MEMORY} -T {params.sort_tmp} -o {params.output_prefix}Aligned.sortedByCoord.out.bam - >> {log} 2>&1",
+                  [("{wildcards.sample}_*", MAPPED_READS_DIR)])
+
+else:
+  rule star_map:
+    input:
+      # This rule really depends on the whole directory (see
+      # params.index_dir), but we can't register it as an input/output
+      # in its own right since Snakemake 5.
+      index_file = rules.star_index.output.star_index_file,
+      reads = map_input
+    output:
+      intermediate(os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.out.bam'))
+    params:
+      index_dir = rules.star_index.params.star_index_dir,
+      work = work_dir('star_map', MAPPED_READS_DIR),
+      output_prefix=os.path.join(work_dir('star_map', MAPPED_READS_DIR), '{sample}_')
+    log: os.path.join(LOG_DIR, 'star_map_{sample}.log')
+    threads: STAR_MAP_THREADS
+    resources:
+      mem_mb = job_memory('star_map', STAR_MAP_MEMORY),
+      disk_mb = job_disk('star_map')
+    benchmark: os.path.join(BENCHMARK_DIR, 'star_map', '{sample}.tsv')
+    shell: staged("rm -rf {params.output_prefix}_STARtmp && {STAR_EXEC_MAP} --runThreadN {STAR_MAP_THREADS} --genomeDir {params.index_dir} {STAR_GENOME_LOAD} --readFilesIn {input.reads} --readFilesCommand '{GUNZIP_EXEC} -c' --outSAMtype BAM Unsorted --outFileNamePrefix {params.output_prefix} >> {log} 2>&1",
+                  [("{wildcards.sample}_*", MAPPED_READS_DIR)])
+
+  rule sort_bam:
+    input: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.out.bam')
+    output: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam')
+    params:
+      work = work_dir('sort_bam', MAPPED_READS_DIR),
+      sort_tmp=os.path.join(work_dir('sort_bam', MAPPED_READS_DIR), '{sample}_sort_tmp'),
+      sorted_bam=os.path.join(work_dir('sort_bam', MAPPED_READS_DIR), '{sample}_Aligned.sortedByCoord.out.bam')
+    log: os.path.join(LOG_DIR, 'samtools_sort_{sample}.log')
+    threads: SORT_BAM_THREADS
+    group: job_group('sort_bam')
+    resources:
+      mem_mb = job_memory('sort_bam'),
+      disk_mb = job_disk('sort_bam')
+    benchmark: os.path.join(BENCHMARK_DIR, 'sort_bam', '{sample}.tsv')
+    shell: bundle_step('sort_bam', staged("{SAMTOOLS_EXEC} sort -@ {SORT_BAM_THREADS} -m {SORT_BAM_MEMORY} -T {params.sort_tmp} -o {params.sorted_bam} {input} >> {log} 2>&1",
+                                          [("{wildcards.sample}_Aligned.sortedByCoord.out.bam", MAPPED_READS_DIR)]))
 
+# The sorted BAM files are indexed by a rule of their own in all modes,
+# so that sorted BAM files without an index (e.g. from an earlier
+# version) are only indexed, not mapped again.
 rule index_bam:
   input: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam')
   output: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam.bai')
   log: os.path.join(LOG_DIR, 'samtools_index_{sample}.log')
-  shell: "{SAMTOOLS_EXEC} index {input} {output} >> {log} 2>&1"
+  threads: INDEX_BAM_THREADS
+  group: job_group('index_bam')
+  resources:
+    mem_mb = job_memory('index_bam')
+  benchmark: os.path.join(BENCHMARK_DIR, 'index_bam', '{sample}.tsv')
+  shell: bundle_step('index_bam', "{SAMTOOLS_EXEC} index -@ " + str(INDEX_BAM_THREADS - 1) + " {input} {output} >> {log} 2>&1")
+
+# FastQC is run on a uniform random subset of approximately
+# FASTQC_SAMPLE_READS alignments of the BAM file, unless this is 0.
+# The fraction to keep is computed from the alignment counts of the BAM
+# index, which count every mate and every alignment of multimapping
+# reads; it is at least 1e-8, so that it is not printed as 0.
+# "samtools view -s" then samples by read name, which keeps the mates
+# and all alignments of a read together and keeps the same fraction of
+# every chromosome.  The subset has the name of the BAM
+# file, so that the reports have the same names in both modes.
+FASTQC_SAMPLE_READS = config['execution']['fastqc_sample_reads']
+
+def fastqc_command():
+  full = "{FASTQC_EXEC} -o {FASTQC_DIR} -f bam {input.bam} >> {log} 2>&1"
+  if not FASTQC_SAMPLE_READS:
+    return full
+  return ("fraction=$({SAMTOOLS_EXEC} idxstats {input.bam} | awk -v reads={FASTQC_SAMPLE_READS} "
+          "'{{ n += $3 + $4 }} END {{ f = n > reads ? reads / n : 1; if (f < 1e-8) f = 1e-8; "
+          "if (f > 0.99999999) print 1; else printf \"%.8f\", f }}') && "
+          "if [ \"$fraction\" = 1 ]; then " + full + "; else "
+          "rm -rf {params.subset_dir} && mkdir -p {params.subset_dir} && "
+          "{SAMTOOLS_EXEC} view -b -s 42${{fraction#0}} -o {params.subset_dir}/{wildcards.sample}_Aligned.sortedByCoord.out.bam {input.bam} >> {log} 2>&1 && "
+          "{FASTQC_EXEC} -o {FASTQC_DIR} -f bam {params.subset_dir}/{wildcards.sample}_Aligned.sortedByCoord.out.bam >> {log} 2>&1 && "
+          "rm -rf {params.subset_dir}; fi")
 
 rule fastqc:
-  input: os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam')
+  input:
+    bam = os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam'),
+    bai = os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam.bai')
   output: os.path.join(FASTQC_DIR, '{sample}_Aligned.sortedByCoord.out_fastqc.zip')
+  params:
+    subset_dir = os.path.join(FASTQC_DIR, 'subset_{sample}')
   log: os.path.join(LOG_DIR, 'fastqc_{sample}.log')
-  shell: "{FASTQC_EXEC} -o {FASTQC_DIR} -f bam {input} >> {log} 2>&1"
+  group: job_group('fastqc')
+  resources:
+    mem_mb = job_memory('fastqc')
+  benchmark: os.path.join(BENCHMARK_DIR, 'fastqc', '{sample}.tsv')
+  shell: bundle_step('fastqc', fastqc_command())
 
 rule salmon_index:
   input:
@@ -325,28 +772,41 @@ rule salmon_index:
   params:
       salmon_index_dir = os.path.join(OUTPUT_DIR, 'salmon_index')
   log: os.path.join(LOG_DIR, 'salmon_index.log')
-  shell: "{SALMON_EXEC} index -t {input} -i {params.salmon_index_dir} -p {SALMON_INDEX_THREADS} >> {log} 2>&1"
+  threads: SALMON_INDEX_THREADS
+  resources:
+    mem_mb = job_memory('salmon_index')
+  benchmark: os.path.join(BENCHMARK_DIR, 'salmon_index.tsv')
+  shell: cached_index_command('salmon_index', [CDNA_FASTA], toolArgs('salmon'),
+                              config['tools']['salmon']['executable'] + " --version",
+                              "{SALMON_EXEC} index -t {input} -i @INDEX_DIR@ -p {SALMON_INDEX_THREADS}") + " >> {log} 2>&1"
 
-rule salmon_quant:
-  input:
-      # This rule really depends on the whole directory (see
-      # params.index_dir), but we can't register it as an input/output
-      # in its own right since Snakemake 5.
-      index_file = rules.salmon_index.output.salmon_index_file,
-      reads = map_input
-  output:
-      os.path.join(SALMON_DIR, "{sample}", "quant.sf"),
-      os.path.join(SALMON_DIR, "{sample}", "quant.genes.sf")
-  params:
-      index_dir = rules.salmon_index.params.salmon_index_dir,
-      outfolder = os.path.join(SALMON_DIR, "{sample}")
-  log: os.path.join(LOG_DIR, 'salmon_quant_{sample}.log')
-  run:
-    if(len(input.reads) == 1):
-        COMMAND = "{SALMON_EXEC} quant -i {params.index_dir} -l A -p {SALMON_QUANT_THREADS} -r {input.reads} -o {params.outfolder} --seqBias --gcBias -g {GTF_FILE} >> {log} 2>&1"
-    elif(len(input.reads) == 2):
-        COMMAND = "{SALMON_EXEC} quant -i {params.index_dir} -l A -p {SALMON_QUANT_THREADS} -1 {input.reads[0]} -2 {input.reads[1]} -o {params.outfolder} --seqBias --gcBias -g {GTF_FILE} >> {log} 2>&1"
-    shell(COMMAND)
+if not STREAM_TRIMMING:
+  rule salmon_quant:
+    input:
+        # This rule really depends on the whole directory (see
+        # params.index_dir), but we can't register it as an input/output
+        # in its own right since Snakemake 5.
+        index_file = rules.salmon_index.output.salmon_index_file,
+        reads = map_input
+    output:
+        os.path.join(SALMON_DIR, "{sample}", "quant.sf"),
+        os.path.join(SALMON_DIR, "{sample}", "quant.genes.sf")
+    params:
+        index_dir = rules.salmon_index.params.salmon_index_dir,
+        work = work_dir('salmon_quant', os.path.join(SALMON_DIR, "{sample}")),
+        outfolder = os.path.join(SALMON_DIR, "{sample}")
+    log: os.path.join(LOG_DIR, 'salmon_quant_{sample}.log')
+    threads: SALMON_QUANT_THREADS
+    resources:
+      mem_mb = job_memory('salmon_quant'),
+      disk_mb = job_disk('salmon_quant')
+    benchmark: os.path.join(BENCHMARK_DIR, 'salmon_quant', '{sample}.tsv')
+    run:
+      if(len(input.reads) == 1):
+          COMMAND = "{SALMON_EXEC} quant -i {params.index_dir} -l A -p {SALMON_QUANT_THREADS} -r {input.reads} -o {params.work} --seqBias --gcBias -g {GTF_FILE} >> {log} 2>&1"
+      elif(len(input.reads) == 2):
+          COMMAND = "{SALMON_EXEC} quant -i {params.index_dir} -l A -p {SALMON_QUANT_THREADS} -1 {input.reads[0]} -2 {input.reads[1]} -o {params.work} --seqBias --gcBias -g {GTF_FILE} >> {log} 2>&1"
+      shell(staged(COMMAND, [("*", "{params.outfolder}")]))
 
 rule counts_from_SALMON:
   input:
@@ -354,41 +814,110 @@ rule counts_from_SALMON:
       quantGenesFiles = expand(os.path.join(SALMON_DIR, "{sample}", "quant.genes.sf"), sample=SAMPLES),
       colDataFile = rules.translate_sample_sheet_for_report.output
   output:
-      os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv"),
-      os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv"),
-      os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.transcripts.tsv"),
-      os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.genes.tsv")
+      matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv")),
+      matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv")),
+      matrix_files(os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.transcripts.tsv")),
+      matrix_files(os.path.join(COUNTS_DIR, "normalized", "TPM_counts_from_SALMON.genes.tsv"))
   log: os.path.join(LOG_DIR, 'salmon_import_counts.log')
-  shell: "{RSCRIPT_EXEC} {SCRIPTS_DIR}/counts_matrix_from_SALMON.R {SALMON_DIR} {COUNTS_DIR} {input.colDataFile} >> {log} 2>&1"
+  resources:
+    mem_mb = job_memory('counts_from_SALMON')
+  benchmark: os.path.join(BENCHMARK_DIR, 'counts_from_SALMON.tsv')
+  params:
+    script = os.path.join(SCRIPTS_DIR, "counts_matrix_from_SALMON.py"),
+    chunk_size = config['counting']['collate_chunk_size']
+  shell: "{PYTHON_EXEC} {params.script} --chunk-size {params.chunk_size} --format {MATRIX_FORMAT} {SALMON_DIR} {COUNTS_DIR} {input.colDataFile} >> {log} 2>&1"
 
 
+# The unscaled coverage of each sample is computed only once by
+# count_reads.  When the size factors change (e.g. because samples were
+# added), only this cheap rescaling of the stored coverage is repeated.
 rule genomeCoverage:
   input:
     size_factors_file=os.path.join(COUNTS_DIR, "normalized", "deseq_size_factors.txt"),
-    bam=os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam'),
-    bai=os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam.bai')
+    coverage=os.path.join(COVERAGE_DIR, '{sample}.coverage.rds')
   output:
     os.path.join(BIGWIG_DIR, '{sample}.forward.bigwig'),
     os.path.join(BIGWIG_DIR, '{sample}.reverse.bigwig')
   log: os.path.join(LOG_DIR, 'genomeCoverage_{sample}.log')
-  shell: "{RSCRIPT_EXEC} {SCRIPTS_DIR}/export_bigwig.R {input.bam} {wildcards.sample} {input.size_factors_file} {BIGWIG_DIR} >> {log} 2>&1"
+  group: job_group('genomeCoverage')
+  resources:
+    mem_mb = job_memory('genomeCoverage')
+  benchmark: os.path.join(BENCHMARK_DIR, 'genomeCoverage', '{sample}.tsv')
+  shell: bundle_step('genomeCoverage', "{RSCRIPT_EXEC} {SCRIPTS_DIR}/export_bigwig.R {input.coverage} {wildcards.sample} {input.size_factors_file} {BIGWIG_DIR} >> {log} 2>&1")
 
-rule multiqc:
+# MultiQC only reads the QC files listed in the manifest of each
+# sample, instead of searching the whole output folder.  The manifest of
+# a sample is written as soon as the sample's QC files are complete.
+# The STAR and SALMON logs are written by the jobs that write the BAM
+# file and the quantification, so these stand in for them as inputs.
+# Trim Galore writes its reports, named after the reads files, next to
+# the trimmed reads without declaring them; they exist once the reads
+# have been mapped.  MultiQC itself still summarizes all samples anew
+# whenever one manifest changes.
+def trimming_reports(sample):
+  if STREAM_TRIMMING:
+    return [os.path.join(TRIMMED_READS_DIR, sample + "_trimming_report.txt")]
+  return [os.path.join(TRIMMED_READS_DIR, os.path.basename(path) + "_trimming_report.txt")
+          for path in SAMPLE_REGISTRY[sample].read_paths]
+
+def qc_files(sample):
+  return trimming_reports(sample) + [
+    os.path.join(MAPPED_READS_DIR, sample + '_Log.final.out'),
+    os.path.join(SALMON_DIR, sample, 'lib_format_counts.json'),
+    os.path.join(SALMON_DIR, sample, 'aux_info', 'meta_info.json'),
+    os.path.join(FASTQC_DIR, sample + '_Aligned.sortedByCoord.out_fastqc.zip')]
+
+localrules: qc_manifest
+
+rule qc_manifest:
   input:
-    salmon_output=expand(os.path.join(SALMON_DIR, "{sample}", "quant.sf"), sample = SAMPLES),
-    star_output=expand(os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam'), sample=SAMPLES),
-    fastqc_output=expand(os.path.join(FASTQC_DIR, '{sample}_Aligned.sortedByCoord.out_fastqc.zip'), sample=SAMPLES),
-  output: os.path.join(MULTIQC_DIR, 'multiqc_report.html')
+    bam = os.path.join(MAPPED_READS_DIR, '{sample}_Aligned.sortedByCoord.out.bam'),
+    quant = os.path.join(SALMON_DIR, "{sample}", "quant.sf"),
+    fastqc = os.path.join(FASTQC_DIR, '{sample}_Aligned.sortedByCoord.out_fastqc.zip'),
+    reports = lambda wildcards: trimming_reports(wildcards.sample) if STREAM_TRIMMING else []
+  output: os.path.join(QC_MANIFEST_DIR, '{sample}.txt')
+  resources:
+    mem_mb = job_memory('qc_manifest')
+  benchmark: os.path.join(BENCHMARK_DIR, 'qc_manifest', '{sample}.tsv')
+  run:
+    paths = qc_files(wildcards.sample)
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+      raise Exception("ERROR: QC files of sample {} are missing: {}".format(wildcards.sample, ", ".join(missing)))
+    with open(output[0], 'w') as outfile:
+      for path in paths:
+        outfile.write(path + "\n")
+
+rule multiqc:
+  input: expand(os.path.join(QC_MANIFEST_DIR, '{sample}.txt'), sample=SAMPLES)
+  output:
+    report = os.path.join(MULTIQC_DIR, 'multiqc_report.html'),
+    manifest = os.path.join(MULTIQC_DIR, 'qc_manifest.txt')
   log: os.path.join(LOG_DIR, 'multiqc.log')
-  shell: "{MULTIQC_EXEC} -o {MULTIQC_DIR} {OUTPUT_DIR} >> {log} 2>&1"
+  resources:
+    mem_mb = job_memory('multiqc')
+  benchmark: os.path.join(BENCHMARK_DIR, 'multiqc.tsv')
+  run:
+    with open(output.manifest, 'w') as outfile:
+      for fragment in input:
+        with open(fragment, 'r') as infile:
+          outfile.write(infile.read())
+    shell("{MULTIQC_EXEC} -f -o {MULTIQC_DIR} --file-list {output.manifest} >> {log} 2>&1")
 
 rule count_reads:
   input:
     bam = os.path.join(MAPPED_READS_DIR, "{sample}_Aligned.sortedByCoord.out.bam"),
-    bai = os.path.join(MAPPED_READS_DIR, "{sample}_Aligned.sortedByCoord.out.bam.bai")
+    bai = os.path.join(MAPPED_READS_DIR, "{sample}_Aligned.sortedByCoord.out.bam.bai"),
+    annotation = ANNOTATION_FILE
   output:
-    os.path.join(MAPPED_READS_DIR, "{sample}.read_counts.csv")
+    counts = os.path.join(MAPPED_READS_DIR, "{sample}.read_counts.csv"),
+    coverage = os.path.join(COVERAGE_DIR, "{sample}.coverage.rds")
   log: os.path.join(LOG_DIR, "{sample}.count_reads.log")
+  threads: COUNT_READS_THREADS
+  group: job_group('count_reads')
+  resources:
+    mem_mb = job_memory('count_reads')
+  benchmark: os.path.join(BENCHMARK_DIR, 'count_reads', '{sample}.tsv')
   params:
     single_end = isSingleEnd,
     mode = config['counting']['counting_mode'],
@@ -398,21 +927,27 @@ rule count_reads:
     group_by = config['counting']['group_feature_by'],
     yield_size = config['counting']['yield_size']
   shell:
-    "{RSCRIPT_EXEC} {SCRIPTS_DIR}/count_reads.R {wildcards.sample} {input.bam} {GTF_FILE} \
+    bundle_step('count_reads', "{RSCRIPT_EXEC} {SCRIPTS_DIR}/count_reads.R {wildcards.sample} {input.bam} {input.annotation} \
         {params.single_end} {params.mode} {params.nonunique} {params.strandedness} \
-        {params.feature} {params.group_by} {params.yield_size} >> {log} 2>&1"
+        {params.feature} {params.group_by} {params.yield_size} {output.coverage} \
+        {COUNT_READS_THREADS} >> {log} 2>&1")
 
 rule collate_read_counts:
   input:
     expand(os.path.join(MAPPED_READS_DIR, "{sample}.read_counts.csv"), sample = SAMPLES)
   output:
-    os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv")
+    matrix_files(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv"))
   log: os.path.join(LOG_DIR, "collate_read_counts.log")
+  resources:
+    mem_mb = job_memory('collate_read_counts')
+  benchmark: os.path.join(BENCHMARK_DIR, 'collate_read_counts.tsv')
   params:
     out_file = os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv"),
-    script = os.path.join(SCRIPTS_DIR, "collate_read_counts.R")
+    script = os.path.join(SCRIPTS_DIR, "collate_read_counts.py"),
+    chunk_size = config['counting']['collate_chunk_size'],
+    chunk_dir = os.path.join(OUTPUT_DIR, 'pigx_work', 'collate_read_counts')
   shell:
-    "{RSCRIPT_EXEC} {params.script} {MAPPED_READS_DIR} {params.out_file} >> {log} 2>&1"
+    "{PYTHON_EXEC} {params.script} --chunk-size {params.chunk_size} --chunk-dir {params.chunk_dir} --format {MATRIX_FORMAT} {MAPPED_READS_DIR} {params.out_file} >> {log} 2>&1"
 
 
 rule htseq_count:
@@ -421,6 +956,9 @@ rule htseq_count:
     stats_file = os.path.join(COUNTS_DIR, "raw_counts", "htseq_stats.txt"),
     counts_file = os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star_htseq-count.txt")
   log: os.path.join(LOG_DIR, "htseq-count.log")
+  resources:
+    mem_mb = job_memory('htseq_count')
+  benchmark: os.path.join(BENCHMARK_DIR, 'htseq_count.tsv')
   params:
     tmp_file = os.path.join(COUNTS_DIR, "raw_counts", "htseq_out.txt")
   shell:
@@ -440,23 +978,56 @@ rule htseq_count:
 # deseq2
 rule norm_counts_deseq:
     input:
-        counts_file = os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv"),
+        counts_file = matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv")),
         colDataFile = rules.translate_sample_sheet_for_report.output
     output:
         size_factors = os.path.join(COUNTS_DIR, "normalized", "deseq_size_factors.txt"),
-        norm_counts = os.path.join(COUNTS_DIR, "normalized", "deseq_normalized_counts.tsv")
+        norm_counts = matrix_files(os.path.join(COUNTS_DIR, "normalized", "deseq_normalized_counts.tsv"))
     log:
         os.path.join(LOG_DIR, "norm_counts_deseq.log")
+    resources:
+        mem_mb = job_memory('norm_counts_deseq')
+    benchmark: os.path.join(BENCHMARK_DIR, 'norm_counts_deseq.tsv')
     params:
         script=os.path.join(SCRIPTS_DIR, "norm_counts_deseq.R"),
         outdir=os.path.join(COUNTS_DIR, "normalized")
     shell:
-        "{RSCRIPT_EXEC} {params.script} {input.counts_file} {input.colDataFile} {params.outdir} >> {log} 2>&1"
+        "{RSCRIPT_EXEC} {params.script} {input.counts_file} {input.colDataFile} {params.outdir} {MATRIX_FORMAT} >> {log} 2>&1"
+
+DESEQ_COUNT_FILES = {
+  'star': matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv")),
+  'salmon.transcripts': matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv")),
+  'salmon.genes': matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv"))
+}
+
+rule deseq_fit:
+  input:
+    counts = lambda wildcards: DESEQ_COUNT_FILES[wildcards.source],
+    coldata = str(rules.translate_sample_sheet_for_report.output)
+  output:
+    os.path.join(DESEQ_MODELS_DIR, '{source}.{key}.rds')
+  wildcard_constraints:
+    source = r"star|salmon\.transcripts|salmon\.genes",
+    key = "[0-9a-f]+"
+  params:
+    script = os.path.join(SCRIPTS_DIR, "fit_deseq_model.R"),
+    case = lambda wildcards: DESEQ_MODELS[wildcards.key]['case_sample_groups'],
+    control = lambda wildcards: DESEQ_MODELS[wildcards.key]['control_sample_groups'],
+    covariates = lambda wildcards: DESEQ_MODELS[wildcards.key]['covariates']
+  threads: DESEQ_FIT_THREADS
+  log: os.path.join(LOG_DIR, "deseq_fit.{source}.{key}.log")
+  resources:
+    mem_mb = job_memory('deseq_fit')
+  benchmark: os.path.join(BENCHMARK_DIR, 'deseq_fit', '{source}.{key}.tsv')
+  shell:
+    "{RSCRIPT_EXEC} {params.script} {input.counts} {input.coldata} '{params.case}' '{params.control}' '{params.covariates}' {output} {threads} >> {log} 2>&1"
 
 rule report1:
   input:
-    counts=os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv"),
+    counts=matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_star.tsv")),
     coldata=str(rules.translate_sample_sheet_for_report.output),
+    annotation=ANNOTATION_FILE,
+    model=deseq_model_file('star')
   params:
     outdir=os.path.join(OUTPUT_DIR, "report"),
     reportR=os.path.join(SCRIPTS_DIR, "runDeseqReport.R"),
@@ -466,15 +1037,20 @@ rule report1:
     covariates = lambda wildcards: DE_ANALYSIS_LIST[wildcards.analysis]['covariates'],
     logo = LOGO
   log: os.path.join(LOG_DIR, "{analysis}.report.star.log")
+  resources:
+    mem_mb = job_memory('report1')
+  benchmark: os.path.join(BENCHMARK_DIR, 'report1', '{analysis}.tsv')
   output:
     os.path.join(OUTPUT_DIR, "report", '{analysis}.star.deseq.report.html')
   shell:
-    "{RSCRIPT_EXEC} {params.reportR} --logo={params.logo} --prefix='{wildcards.analysis}.star' --reportFile={params.reportRmd} --countDataFile={input.counts} --colDataFile={input.coldata} --gtfFile={GTF_FILE} --caseSampleGroups='{params.case}' --controlSampleGroups='{params.control}' --covariates='{params.covariates}'  --workdir={params.outdir} --organism='{ORGANISM}'  >> {log} 2>&1"
+    "{RSCRIPT_EXEC} {params.reportR} --logo={params.logo} --prefix='{wildcards.analysis}.star' --reportFile={params.reportRmd} --countDataFile={input.counts} --colDataFile={input.coldata} --gtfFile={GTF_FILE} --annotationFile={input.annotation} --deseqModelFile={input.model} --caseSampleGroups='{params.case}' --controlSampleGroups='{params.control}' --covariates='{params.covariates}'  --workdir={params.outdir} --organism='{ORGANISM}'  >> {log} 2>&1"
 
 rule report2:
   input:
-    counts=os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv"),
-    coldata=str(rules.translate_sample_sheet_for_report.output)
+    counts=matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.transcripts.tsv")),
+    coldata=str(rules.translate_sample_sheet_for_report.output),
+    annotation=ANNOTATION_FILE,
+    model=deseq_model_file('salmon.transcripts')
   params:
     outdir=os.path.join(OUTPUT_DIR, "report"),
     reportR=os.path.join(SCRIPTS_DIR, "runDeseqReport.R"),
@@ -484,14 +1060,19 @@ rule report2:
     covariates = lambda wildcards: DE_ANALYSIS_LIST[wildcards.analysis]['covariates'],
     logo = os.path.join(config['locations']['pkgdatadir'], "images/Logo_PiGx.png") if os.getenv("PIGX_UNINSTALLED") else os.path.join(config['locations']['pkgdatadir'], "Logo_PiGx.png")
   log: os.path.join(LOG_DIR, "{analysis}.report.salmon.transcripts.log")
+  resources:
+    mem_mb = job_memory('report2')
+  benchmark: os.path.join(BENCHMARK_DIR, 'report2', '{analysis}.tsv')
   output:
     os.path.join(OUTPUT_DIR, "report", '{analysis}.salmon.transcripts.deseq.report.html')
-  shell: "{RSCRIPT_EXEC} {params.reportR} --logo={params.logo} --prefix='{wildcards.analysis}.salmon.transcripts' --reportFile={params.reportRmd} --countDataFile={input.counts} --colDataFile={input.coldata} --gtfFile={GTF_FILE} --caseSampleGroups='{params.case}' --controlSampleGroups='{params.control}' --covariates='{params.covariates}' --workdir={params.outdir} --organism='{ORGANISM}' >> {log} 2>&1"
+  shell: "{RSCRIPT_EXEC} {params.reportR} --logo={params.logo} --prefix='{wildcards.analysis}.salmon.transcripts' --reportFile={params.reportRmd} --countDataFile={input.counts} --colDataFile={input.coldata} --gtfFile={GTF_FILE} --annotationFile={input.annotation} --deseqModelFile={input.model} --caseSampleGroups='{params.case}' --controlSampleGroups='{params.control}' --covariates='{params.covariates}' --workdir={params.outdir} --organism='{ORGANISM}' >> {log} 2>&1"
 
 rule report3:
   input:
-    counts=os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv"),
-    coldata=str(rules.translate_sample_sheet_for_report.output)
+    counts=matrix_file(os.path.join(COUNTS_DIR, "raw_counts", "counts_from_SALMON.genes.tsv")),
+    coldata=str(rules.translate_sample_sheet_for_report.output),
+    annotation=ANNOTATION_FILE,
+    model=deseq_model_file('salmon.genes')
   params:
     outdir=os.path.join(OUTPUT_DIR, "report"),
     reportR=os.path.join(SCRIPTS_DIR, "runDeseqReport.R"),
@@ -501,6 +1082,9 @@ rule report3:
     covariates = lambda wildcards: DE_ANALYSIS_LIST[wildcards.analysis]['covariates'],
     logo = os.path.join(config['locations']['pkgdatadir'], "images/Logo_PiGx.png") if os.getenv("PIGX_UNINSTALLED") else os.path.join(config['locations']['pkgdatadir'], "Logo_PiGx.png")
   log: os.path.join(LOG_DIR, "{analysis}.report.salmon.genes.log")
+  resources:
+    mem_mb = job_memory('report3')
+  benchmark: os.path.join(BENCHMARK_DIR, 'report3', '{analysis}.tsv')
   output:
     os.path.join(OUTPUT_DIR, "report", '{analysis}.salmon.genes.deseq.report.html')
-  shell: "{RSCRIPT_EXEC} {params.reportR} --logo={params.logo} --prefix='{wildcards.analysis}.salmon.genes' --reportFile={params.reportRmd} --countDataFile={input.counts} --colDataFile={input.coldata} --gtfFile={GTF_FILE} --caseSampleGroups='{params.case}' --controlSampleGroups='{params.control}' --covariates='{params.covariates}' --workdir={params.outdir} --organism='{ORGANISM}' >> {log} 2>&1"
+  shell: "{RSCRIPT_EXEC} {params.reportR} --logo={params.logo} --prefix='{wildcards.analysis}.salmon.genes' --reportFile={params.reportRmd} --countDataFile={input.counts} --colDataFile={input.coldata} --gtfFile={GTF_FILE} --annotationFile={input.annotation} --deseqModelFile={input.model} --caseSampleGroups='{params.case}' --controlSampleGroups='{params.control}' --covariates='{params.covariates}' --workdir={params.outdir} --organism='{ORGANISM}' >> {log} 2>&1"
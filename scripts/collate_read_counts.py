@@ -0,0 +1,243 @@
+# PiGx RNAseq Pipeline.
+#
+# Copyright © 2019 Bora Uyar <bora.uyar@mdc-berlin.de>
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Collate per-sample read counts into one big matrix.
+
+The per-sample tables written by count_reads.R are merged in a single
+streaming pass.  Samples are processed in chunks of columns: each chunk
+is written to its own matrix file, holding at most CHUNK_SIZE columns
+in memory, and the chunk files are then pasted together line by line.
+Memory use is therefore bounded by the number of features times the
+chunk size, independent of the number of samples.
+
+With --chunk-dir the chunks are kept between runs.  When samples are
+added to a project, only the new tables are read; the chunks of the
+other samples are reused and merely pasted into the new matrix.
+
+The output is identical to what the former R implementation produced
+by merging all tables with data.table (left join on the features of the
+first table, rows sorted by feature id in C locale order).
+"""
+
+import os
+import re
+import sys
+import json
+import locale
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+from count_matrix import open_matrix
+
+COUNTS_FILE_PATTERN = re.compile(r'.read_counts.csv$')
+
+def find_count_files(input_dir):
+    """Return the per-sample count tables in INPUT_DIR in the same order
+as R's dir() would list them, i.e. collated according to the LC_COLLATE
+locale of the environment (see use_collation_locale)."""
+    names = sorted((f for f in os.listdir(input_dir) if COUNTS_FILE_PATTERN.search(f)),
+                   key=locale.strxfrm)
+    return [os.path.join(input_dir, f) for f in names]
+
+def use_collation_locale():
+    """Collate strings according to the locale of the environment, as R
+does on startup.  Fall back to the C locale (byte order) when that
+locale is not available."""
+    try:
+        locale.setlocale(locale.LC_COLLATE, '')
+    except locale.Error:
+        locale.setlocale(locale.LC_COLLATE, 'C')
+
+def read_count_table(path):
+    """Read a per-sample count table.  Return the sample name, the list
+of feature ids and the list of counts (as strings) in file order."""
+    features = []
+    counts = []
+    with open(path, 'r') as infile:
+        header = infile.readline().rstrip('\n').split(',')
+        for line in infile:
+            feature, value = line.rstrip('\n').split(',')
+            features.append(feature)
+            counts.append(sys.intern(value))
+    return header[1], features, counts
+
+def align_counts(features, counts, reference, index):
+    """Return COUNTS reordered to follow the REFERENCE feature list.
+Features missing from the table are reported as NA, features unknown
+to the reference are dropped.  INDEX is a mutable single-element list
+caching the feature->position mapping of REFERENCE, which is only
+built when a table deviates from the reference order."""
+    if features == reference:
+        return counts
+    if index[0] is None:
+        index[0] = {feature: i for i, feature in enumerate(reference)}
+    aligned = ['NA'] * len(reference)
+    for feature, value in zip(features, counts):
+        i = index[0].get(feature)
+        if i is not None:
+            aligned[i] = value
+    return aligned
+
+def write_chunk(path, samples, columns, reference, order):
+    """Write one chunk of columns as a tab-separated matrix, with rows
+in ORDER."""
+    with open(path, 'w') as outfile:
+        outfile.write('\t'.join(samples) + '\n')
+        for i in order:
+            outfile.write(reference[i] + '\t' + '\t'.join(column[i] for column in columns) + '\n')
+
+def paste_chunks(chunk_files, out_file, columns=None, matrix_format='tsv', dtype='int32'):
+    """Paste the matrices in CHUNK_FILES column-wise into OUT_FILE.  All
+chunks have the same row names in the same order; only the row names
+of the first chunk are kept.  COLUMNS optionally gives the output
+order of the columns as (chunk, column) positions.  The matrix is
+written in MATRIX_FORMAT with values of type DTYPE (see
+count_matrix.py)."""
+    handles = [open(f, 'r') for f in chunk_files]
+    try:
+        with open_matrix(out_file, matrix_format, dtype) as outfile:
+            # The header line has no field for the row names.
+            header = [handle.readline().rstrip('\n') for handle in handles]
+            if columns is None:
+                outfile.write('\t'.join(header) + '\n')
+                for lines in zip(*handles):
+                    rest = [line.rstrip('\n').split('\t', 1)[1] for line in lines[1:]]
+                    outfile.write('\t'.join([lines[0].rstrip('\n')] + rest) + '\n')
+            else:
+                header = [h.split('\t') for h in header]
+                outfile.write('\t'.join(header[c][i] for c, i in columns) + '\n')
+                for lines in zip(*handles):
+                    fields = [line.rstrip('\n').split('\t') for line in lines]
+                    outfile.write(fields[0][0] + '\t' + '\t'.join(fields[c][i + 1] for c, i in columns) + '\n')
+    finally:
+        for handle in handles:
+            handle.close()
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+def plan_chunks(count_files, manifest, reference_key, chunk_size):
+    """Split COUNT_FILES into chunks.  Chunks recorded in the MANIFEST of
+an earlier run are kept if none of their inputs changed; the remaining
+tables are grouped into new chunks of up to CHUNK_SIZE tables.  Return
+the list of kept chunks and the list of new chunks (lists of paths)."""
+    signatures = {path: file_signature(path) for path in count_files}
+    kept = []
+    if manifest and manifest.get('reference') == reference_key:
+        for chunk in manifest['chunks']:
+            if os.path.isfile(chunk['file']) and \
+               all(signatures.get(path) == signature for path, signature in chunk['inputs']):
+                kept.append(chunk)
+    # A partial chunk is rebuilt together with the new tables, so that
+    # adding samples one by one does not fragment the matrix.
+    if kept and len(kept[-1]['inputs']) < chunk_size:
+        kept.pop()
+    covered = set(path for chunk in kept for path, _ in chunk['inputs'])
+    todo = [path for path in count_files if path not in covered]
+    return kept, [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+def collate(count_files, out_file, chunk_size, chunk_dir=None, matrix_format='tsv'):
+    """Merge COUNT_FILES into the count matrix OUT_FILE (in MATRIX_FORMAT,
+see count_matrix.py), holding at most CHUNK_SIZE samples in memory at
+a time.  If CHUNK_DIR is given, the
+column chunks are kept there as standalone matrices together with a
+manifest of their inputs, and chunks whose inputs did not change are
+reused by later runs: only new or modified tables are read again."""
+    if not count_files:
+        raise Exception("ERROR: no read count tables to collate.")
+
+    _, reference, _ = read_count_table(count_files[0])
+    # A single table is passed through in file order; merged tables
+    # are sorted by feature id.
+    if len(count_files) == 1:
+        order = range(len(reference))
+    else:
+        order = sorted(range(len(reference)), key=reference.__getitem__)
+    index = [None]
+    reference_key = hashlib.md5('{}\n{}'.format(len(count_files) == 1, '\n'.join(reference)).encode()).hexdigest()
+
+    workdir = chunk_dir if chunk_dir else tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_file)))
+    os.makedirs(workdir, exist_ok=True)
+    manifest_file = os.path.join(workdir, 'manifest.json')
+    manifest = None
+    if chunk_dir and os.path.isfile(manifest_file):
+        with open(manifest_file, 'r') as infile:
+            manifest = json.load(infile)
+    try:
+        chunks, todo = plan_chunks(count_files, manifest, reference_key, chunk_size)
+        if chunks:
+            print('Reusing {} of {} count tables from earlier runs'.format(
+                sum(len(chunk['inputs']) for chunk in chunks), len(count_files)), flush=True)
+        for paths in todo:
+            samples = []
+            columns = []
+            for path in paths:
+                sample, features, counts = read_count_table(path)
+                samples.append(sample)
+                columns.append(align_counts(features, counts, reference, index))
+            name = hashlib.md5('\n'.join(paths).encode()).hexdigest()[:16]
+            chunk_file = os.path.join(workdir, 'chunk_{}.tsv'.format(name))
+            write_chunk(chunk_file, samples, columns, reference, order)
+            chunks.append({'file': chunk_file,
+                           'inputs': [[path, file_signature(path)] for path in paths]})
+            del samples, columns
+
+        # Columns follow the order of COUNT_FILES, whatever chunk they
+        # are stored in.
+        position = {path: (c, i) for c, chunk in enumerate(chunks)
+                    for i, (path, _) in enumerate(chunk['inputs'])}
+        columns = [position[path] for path in count_files]
+        if columns == sorted(columns):
+            columns = None
+        paste_chunks([chunk['file'] for chunk in chunks], out_file, columns, matrix_format)
+
+        if chunk_dir:
+            with open(manifest_file, 'w') as outfile:
+                json.dump({'reference': reference_key, 'chunks': chunks}, outfile)
+            current = set(os.path.basename(chunk['file']) for chunk in chunks)
+            for f in os.listdir(workdir):
+                if f.startswith('chunk_') and f not in current:
+                    os.remove(os.path.join(workdir, f))
+    finally:
+        if not chunk_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return [chunk['file'] for chunk in chunks]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collate per-sample read counts into one count matrix.')
+    parser.add_argument('input_dir', help='Folder containing the {sample}.read_counts.csv files')
+    parser.add_argument('out_file', help='Path of the collated count matrix')
+    parser.add_argument('--chunk-size', type=int, default=250,
+                        help='Number of samples to hold in memory at a time [250]')
+    parser.add_argument('--chunk-dir', default=None,
+                        help='Keep the column chunks of the matrix in this folder and reuse them in later runs')
+    parser.add_argument('--format', choices=['tsv', 'binary', 'both'], default='tsv',
+                        help='Write the matrix as TSV, as .cmat file or both [tsv]')
+    args = parser.parse_args()
+
+    if args.chunk_size < 1:
+        raise Exception("ERROR: --chunk-size must be a positive number.")
+    use_collation_locale()
+    collate(find_count_files(args.input_dir), args.out_file,
+            args.chunk_size, args.chunk_dir, args.format)
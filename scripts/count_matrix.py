@@ -0,0 +1,270 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read and write count matrices in a compressed, chunked columnar format.
+
+A .cmat file holds a numeric matrix with row and column names.  The
+rows are split into blocks, and every column of a block is compressed
+separately with zlib, so that selected columns and rows can be read
+without decompressing the rest of the matrix.  The layout is
+
+  MAGIC
+  block 0: column 0, column 1, ...   (zlib-compressed little-endian
+  block 1: column 0, column 1, ...    int32 or float64 values)
+  ...
+  footer                             (JSON: dtype, row names, column
+                                      names, and for every block its
+                                      number of rows and the offsets
+                                      and sizes of its columns)
+  length of the footer               (little-endian int32)
+  MAGIC
+
+Missing values are stored as R's NA_integer_ in int32 matrices and as
+NaN in float64 matrices.  count_matrix.R reads and writes the same
+format.
+
+Usage:
+  count_matrix.py to-tsv MATRIX.cmat OUT.tsv [--columns A,B] [--rows X,Y]
+  count_matrix.py from-tsv MATRIX.tsv OUT.cmat [--dtype int32|float64]
+"""
+
+import os
+import sys
+import json
+import zlib
+import struct
+import bisect
+import argparse
+from array import array
+
+MAGIC = b'PIGXCMAT'
+NA_INTEGER = -2 ** 31
+TYPECODES = {'int32': 'i', 'float64': 'd'}
+# Number of values buffered per block, over all columns.
+BLOCK_VALUES = 1 << 23
+
+def matrix_files(tsv_file, matrix_format):
+    """Return the files holding the matrix TSV_FILE in MATRIX_FORMAT:
+'tsv', 'binary' (the .cmat file) or 'both'."""
+    binary_file = os.path.splitext(tsv_file)[0] + '.cmat'
+    return {'tsv': [tsv_file], 'binary': [binary_file], 'both': [tsv_file, binary_file]}[matrix_format]
+
+def parse_value(dtype):
+    if dtype == 'int32':
+        return lambda v: NA_INTEGER if v == 'NA' else int(v)
+    return lambda v: float('nan') if v == 'NA' else float(v)
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+class MatrixWriter:
+    """File-like object that takes a matrix as tab-separated text, laid
+out like R's write.table output (the header line has no field for the
+row names), and writes it to PATH in the .cmat format."""
+
+    def __init__(self, path, dtype='float64', block_rows=None):
+        self.out = open(path, 'wb')
+        self.out.write(MAGIC)
+        self.dtype = dtype
+        self.parse = parse_value(dtype)
+        self.block_rows = block_rows
+        self.pending = ''
+        self.columns = None
+        self.row_names = []
+        self.blocks = []
+        self.buffer = None
+        self.buffered = 0
+
+    def write(self, text):
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            fields = line.split('\t')
+            if self.columns is None:
+                self.columns = fields
+                if not self.block_rows:
+                    self.block_rows = max(1024, min(65536, BLOCK_VALUES // max(1, len(fields))))
+                self.buffer = [array(TYPECODES[self.dtype]) for _ in fields]
+                continue
+            if len(fields) != len(self.columns) + 1:
+                raise Exception("ERROR: row {} has {} values instead of {}.".format(
+                    fields[0], len(fields) - 1, len(self.columns)))
+            self.row_names.append(fields[0])
+            for column, value in zip(self.buffer, fields[1:]):
+                column.append(self.parse(value))
+            self.buffered += 1
+            if self.buffered == self.block_rows:
+                self.flush_block()
+
+    def flush_block(self):
+        offsets = []
+        sizes = []
+        for column in self.buffer:
+            data = zlib.compress(little_endian(column), 6)
+            offsets.append(self.out.tell())
+            sizes.append(len(data))
+            self.out.write(data)
+            del column[:]
+        self.blocks.append({'rows': self.buffered, 'offsets': offsets, 'sizes': sizes})
+        self.buffered = 0
+
+    def close(self):
+        if self.pending:
+            self.write('\n')
+        if self.columns is None:
+            raise Exception("ERROR: the matrix has no header line.")
+        if self.buffered:
+            self.flush_block()
+        footer = json.dumps({'dtype': self.dtype, 'rows': self.row_names,
+                             'columns': self.columns, 'blocks': self.blocks}).encode()
+        self.out.write(footer)
+        self.out.write(struct.pack('<i', len(footer)))
+        self.out.write(MAGIC)
+        self.out.close()
+
+class MatrixOutputs:
+    """File-like object writing the matrix text written to it to all of
+the given file-like OUTPUTS."""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def write(self, text):
+        for output in self.outputs:
+            output.write(text)
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_matrix(tsv_file, matrix_format='tsv', dtype='float64'):
+    """Open the matrix TSV_FILE for writing in MATRIX_FORMAT (see
+matrix_files).  The returned object takes the matrix as tab-separated
+text and must be closed."""
+    outputs = []
+    for path in matrix_files(tsv_file, matrix_format):
+        if path.endswith('.cmat'):
+            outputs.append(MatrixWriter(path, dtype))
+        else:
+            outputs.append(open(path, 'w'))
+    return MatrixOutputs(outputs)
+
+def read_footer(infile):
+    infile.seek(-len(MAGIC) - 4, os.SEEK_END)
+    length = struct.unpack('<i', infile.read(4))[0]
+    if infile.read(len(MAGIC)) != MAGIC:
+        raise Exception("ERROR: {} is not a count matrix file.".format(infile.name))
+    infile.seek(-len(MAGIC) - 4 - length, os.SEEK_END)
+    return json.loads(infile.read(length).decode())
+
+def read_matrix(path, columns=None, rows=None):
+    """Read the .cmat file PATH.  Return the row names, the column names
+and one array of values per column.  COLUMNS and ROWS optionally
+select columns and rows by name; only the blocks holding the selected
+rows and only the selected columns are decompressed."""
+    with open(path, 'rb') as infile:
+        footer = read_footer(infile)
+        column_index = {name: j for j, name in enumerate(footer['columns'])}
+        selected_columns = list(range(len(footer['columns']))) if columns is None else \
+            [column_index[name] for name in columns]
+        if rows is None:
+            wanted = None
+            row_names = footer['rows']
+        else:
+            row_index = {name: i for i, name in enumerate(footer['rows'])}
+            wanted = [row_index[name] for name in rows]
+            row_names = list(rows)
+        values = [array(TYPECODES[footer['dtype']]) for _ in selected_columns]
+        if wanted is None:
+            for block in footer['blocks']:
+                for j, column in zip(selected_columns, values):
+                    infile.seek(int(block['offsets'][j]))
+                    column.frombytes(zlib.decompress(infile.read(int(block['sizes'][j]))))
+        else:
+            # index of the first row of every block
+            starts = [0]
+            for block in footer['blocks']:
+                starts.append(starts[-1] + int(block['rows']))
+            cache = {}
+            for column in values:
+                column.extend([0] * len(wanted))
+            for k, i in enumerate(wanted):
+                b = bisect.bisect_right(starts, i) - 1
+                if b not in cache:
+                    block = footer['blocks'][b]
+                    cache[b] = []
+                    for j in selected_columns:
+                        infile.seek(int(block['offsets'][j]))
+                        decoded = array(TYPECODES[footer['dtype']])
+                        decoded.frombytes(zlib.decompress(infile.read(int(block['sizes'][j]))))
+                        cache[b].append(decoded)
+                for column, decoded in zip(values, cache[b]):
+                    column[k] = decoded[i - starts[b]]
+        if sys.byteorder != 'little':
+            for column in values:
+                column.byteswap()
+    return row_names, [footer['columns'][j] for j in selected_columns], values
+
+def format_value(value):
+    if value == NA_INTEGER or value != value:
+        return 'NA'
+    if isinstance(value, float):
+        return '%.15g' % value
+    return str(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert count matrices between TSV and the .cmat format.')
+    subparsers = parser.add_subparsers(dest='command')
+    to_tsv = subparsers.add_parser('to-tsv', help='Write a .cmat file as TSV')
+    to_tsv.add_argument('matrix')
+    to_tsv.add_argument('out_file')
+    to_tsv.add_argument('--columns', default=None, help='Comma separated list of columns to keep')
+    to_tsv.add_argument('--rows', default=None, help='Comma separated list of rows to keep')
+    from_tsv = subparsers.add_parser('from-tsv', help='Write a TSV matrix as .cmat file')
+    from_tsv.add_argument('matrix')
+    from_tsv.add_argument('out_file')
+    from_tsv.add_argument('--dtype', choices=sorted(TYPECODES), default='float64')
+    args = parser.parse_args()
+
+    if args.command == 'to-tsv':
+        row_names, column_names, values = read_matrix(
+            args.matrix,
+            args.columns.split(',') if args.columns else None,
+            args.rows.split(',') if args.rows else None)
+        with open(args.out_file, 'w') as outfile:
+            outfile.write('\t'.join(column_names) + '\n')
+            for i, name in enumerate(row_names):
+                outfile.write(name + '\t' + '\t'.join(format_value(column[i]) for column in values) + '\n')
+    elif args.command == 'from-tsv':
+        writer = MatrixWriter(args.out_file, args.dtype)
+        with open(args.matrix, 'r') as infile:
+            for line in infile:
+                writer.write(line)
+        writer.close()
+    else:
+        parser.print_help()
@@ -0,0 +1,169 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Collate the SALMON quantifications of all samples into count matrices.
+
+Four matrices are written in a single pass over the per-sample
+quant.sf and quant.genes.sf files:
+
+  raw_counts/counts_from_SALMON.{transcripts,genes}.tsv
+  normalized/TPM_counts_from_SALMON.{transcripts,genes}.tsv
+
+Samples are processed in chunks of columns, as in collate_read_counts.py.
+The values of a chunk are held in preallocated arrays of doubles, one
+per sample, so memory use is bounded by the number of transcripts times
+the chunk size, independent of the number of samples.  All quant files
+of one level must list the same transcripts (genes) in the same order.
+
+The output is the same as that of the former R implementation: raw
+counts are the NumReads column rounded to integers, with rows in the
+order of the quant files; TPM values keep the rows sorted by name.
+"""
+
+import os
+import csv
+import shutil
+import argparse
+import tempfile
+from array import array
+
+from collate_read_counts import paste_chunks
+
+LEVELS = [('transcripts', 'quant.sf'), ('genes', 'quant.genes.sf')]
+
+def read_samples(col_data_file):
+    """Return the sample names (the row names) of the colData.tsv file
+written by translate_sample_sheet_for_report.R."""
+    with open(col_data_file, 'r') as infile:
+        rows = list(csv.reader(infile, delimiter='\t'))
+    return [row[0] for row in rows[1:] if row]
+
+def read_names(path):
+    """Return the list of transcript (gene) names of the quant file PATH."""
+    with open(path, 'r') as infile:
+        infile.readline()
+        return [line.split('\t', 1)[0] for line in infile]
+
+def fill_columns(path, names, num_reads, tpm):
+    """Read the NumReads and TPM columns of the quant file PATH into the
+preallocated arrays NUM_READS and TPM.  The rows must list NAMES in
+the same order."""
+    with open(path, 'r') as infile:
+        header = infile.readline().rstrip('\n').split('\t')
+        name_col, tpm_col, reads_col = (header.index(c) for c in ('Name', 'TPM', 'NumReads'))
+        i = -1
+        for i, line in enumerate(infile):
+            fields = line.rstrip('\n').split('\t')
+            if i >= len(names) or fields[name_col] != names[i]:
+                raise Exception("ERROR: {} does not list the same entries in the same order as the other quant files (line {}).".format(path, i + 2))
+            tpm[i] = float(fields[tpm_col])
+            num_reads[i] = float(fields[reads_col])
+    if i + 1 != len(names):
+        raise Exception("ERROR: {} holds {} entries instead of {}.".format(path, i + 1, len(names)))
+
+def format_count(value):
+    """Format a number of reads like DESeq2's integer counts."""
+    return str(int(round(value)))
+
+def format_number(value):
+    """Format VALUE like R's write.table does: with up to 15 significant
+digits, in fixed notation unless scientific notation is shorter."""
+    if value == 0:
+        return '0'
+    reference = float('%.15g' % value)
+    for digits in range(1, 16):
+        sci = '%.*e' % (digits - 1, value)
+        if float(sci) == reference:
+            break
+    exponent = int(sci.split('e')[1])
+    fixed = '%.*f' % (max(0, digits - 1 - exponent), value)
+    return fixed if len(fixed) <= len(sci) else sci
+
+def write_chunk(path, samples, columns, names, order, formatter):
+    """Write one chunk of numeric COLUMNS as a tab-separated matrix, with
+rows in ORDER."""
+    with open(path, 'w') as outfile:
+        outfile.write('\t'.join(samples) + '\n')
+        for i in order:
+            outfile.write(names[i] + '\t' + '\t'.join(formatter(column[i]) for column in columns) + '\n')
+
+def collate(salmon_dir, samples, counts_dir, chunk_size, matrix_format='tsv'):
+    """Collate the quant files of SAMPLES in SALMON_DIR into the four
+count matrices in COUNTS_DIR (in MATRIX_FORMAT, see count_matrix.py),
+holding at most CHUNK_SIZE samples in memory at a time."""
+    if not samples:
+        raise Exception("ERROR: no samples to collate SALMON quantifications for.")
+
+    levels = []
+    for level, quant_file in LEVELS:
+        names = read_names(os.path.join(salmon_dir, samples[0], quant_file))
+        levels.append({
+            'level': level,
+            'quant_file': quant_file,
+            'names': names,
+            'tpm_order': sorted(range(len(names)), key=names.__getitem__),
+            'outputs': {
+                'counts': os.path.join(counts_dir, 'raw_counts', 'counts_from_SALMON.{}.tsv'.format(level)),
+                'tpm': os.path.join(counts_dir, 'normalized', 'TPM_counts_from_SALMON.{}.tsv'.format(level))},
+            'chunks': {'counts': [], 'tpm': []}})
+
+    workdir = tempfile.mkdtemp(dir=counts_dir)
+    try:
+        for start in range(0, len(samples), chunk_size):
+            chunk = samples[start:start + chunk_size]
+            for entry in levels:
+                n = len(entry['names'])
+                num_reads = [array('d', bytes(8 * n)) for _ in chunk]
+                tpm = [array('d', bytes(8 * n)) for _ in chunk]
+                for j, sample in enumerate(chunk):
+                    fill_columns(os.path.join(salmon_dir, sample, entry['quant_file']),
+                                 entry['names'], num_reads[j], tpm[j])
+                for kind, columns, order, formatter in [
+                        ('counts', num_reads, range(n), format_count),
+                        ('tpm', tpm, entry['tpm_order'], format_number)]:
+                    chunk_file = os.path.join(workdir, '{}.{}.{:05d}.tsv'.format(
+                        kind, entry['level'], len(entry['chunks'][kind])))
+                    write_chunk(chunk_file, chunk, columns, entry['names'], order, formatter)
+                    entry['chunks'][kind].append(chunk_file)
+                del num_reads, tpm
+
+        for entry in levels:
+            for kind in ('counts', 'tpm'):
+                out_file = entry['outputs'][kind]
+                os.makedirs(os.path.dirname(out_file), exist_ok=True)
+                paste_chunks(entry['chunks'][kind], out_file, matrix_format=matrix_format,
+                             dtype='int32' if kind == 'counts' else 'float64')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collate SALMON quantifications into count matrices.')
+    parser.add_argument('salmon_dir', help='Folder containing one SALMON output folder per sample')
+    parser.add_argument('counts_dir', help='Folder to write the raw_counts and normalized matrices to')
+    parser.add_argument('col_data_file', help='colData.tsv file listing the samples')
+    parser.add_argument('--chunk-size', type=int, default=250,
+                        help='Number of samples to hold in memory at a time [250]')
+    parser.add_argument('--format', choices=['tsv', 'binary', 'both'], default='tsv',
+                        help='Write the matrices as TSV, as .cmat files or both [tsv]')
+    args = parser.parse_args()
+
+    if args.chunk_size < 1:
+        raise Exception("ERROR: --chunk-size must be a positive number.")
+    os.makedirs(args.counts_dir, exist_ok=True)
+    collate(args.salmon_dir, read_samples(args.col_data_file), args.counts_dir, args.chunk_size, args.format)
@@ -0,0 +1,180 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Distribute the FASTQ reads read from stdin to several named pipes.
+
+The reads trimmed by cutadapt are passed on to STAR and SALMON, which
+read them from named pipes.  Paired reads arrive interleaved (a record
+of the first mate followed by one of the second) and go to one pipe
+per mate for each reader.  The readers take large chunks of one mate
+before turning to the other, so writing the records in the order they
+arrive would block on the full pipe of one mate while the reader waits
+for the other.  All outputs are therefore written without blocking:
+what a reader is not ready for is kept in memory, and reading from
+stdin pauses while more than --buffer-mb MB are kept.  The buffer has
+to hold what a reader takes of one mate ahead of the other.
+
+Example:
+
+  cutadapt --interleaved -o - r1.fastq.gz r2.fastq.gz | \\
+      python fan_out_reads.py -1 star_R1 salmon_R1 -2 star_R2 salmon_R2 \\
+      --keep1 trimmed_R1.fastq.gz --keep2 trimmed_R2.fastq.gz
+
+Reads of single end samples are given with -1 only.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import argparse
+import subprocess
+import collections
+
+CHUNK_SIZE = 1024 * 1024
+
+def open_outputs(paths):
+    """Open the named pipes (or files) at PATHS for writing without
+blocking.  A pipe can only be opened once its reader has opened it,
+and the readers open their pipes in any order, so all of them are
+tried until every one is open."""
+    fds = {}
+    while len(fds) < len(paths):
+        for path in paths:
+            if path in fds:
+                continue
+            try:
+                fds[path] = os.open(path, os.O_WRONLY | os.O_NONBLOCK | os.O_CREAT | os.O_TRUNC, 0o644)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+        if len(fds) < len(paths):
+            time.sleep(0.05)
+    return [fds[path] for path in paths]
+
+def compress_to(path, gzip='gzip'):
+    """Start GZIP compressing into the file PATH.  Return the process and
+the non-blocking file descriptor of its input."""
+    infd, outfd = os.pipe()
+    with open(path, 'wb') as outfile:
+        process = subprocess.Popen([gzip, '-c'], stdin=infd, stdout=outfile)
+    os.close(infd)
+    os.set_blocking(outfd, False)
+    return process, outfd
+
+class MateSplitter:
+    """Split interleaved FASTQ text into the complete records of each
+mate, keeping incomplete pairs for the next piece of text."""
+
+    def __init__(self, mates):
+        self.mates = mates
+        self.rest = b''
+
+    def split(self, data):
+        if self.mates == 1:
+            return [data]
+        lines = (self.rest + data).split(b'\n')
+        complete = (len(lines) - 1) // 8 * 8
+        self.rest = b'\n'.join(lines[complete:])
+        first, second = [], []
+        for i in range(0, complete, 8):
+            first += lines[i:i + 4]
+            second += lines[i + 4:i + 8]
+        return [b'\n'.join(first) + b'\n' if first else b'',
+                b'\n'.join(second) + b'\n' if second else b'']
+
+    def finish(self):
+        if self.rest.strip():
+            raise Exception("ERROR: the interleaved reads end with an incomplete pair.")
+        return [b''] * self.mates
+
+def fan_out(infd, outputs, buffer_size):
+    """Copy the reads from the file descriptor INFD to OUTPUTS, a list of
+non-blocking file descriptors for each mate, keeping at most
+BUFFER_SIZE bytes (plus one chunk) in memory.  Every output is closed
+as soon as all of its reads are written."""
+    splitter = MateSplitter(len(outputs))
+    queues = collections.OrderedDict((fd, collections.deque()) for fds in outputs for fd in fds)
+    queued = 0
+    done = False
+    while queues:
+        readable = [infd] if not done and queued < buffer_size else []
+        writable = [fd for fd, queue in queues.items() if queue]
+        readable, writable, _ = select.select(readable, writable, [])
+        for fd in writable:
+            queue = queues[fd]
+            try:
+                written = os.write(fd, queue[0])
+            except BlockingIOError:
+                continue
+            except BrokenPipeError:
+                raise Exception("ERROR: a reader of the reads exited before reading all of them.")
+            queued -= written
+            if written < len(queue[0]):
+                queue[0] = queue[0][written:]
+            else:
+                queue.popleft()
+            if done and not queue:
+                os.close(fd)
+                del queues[fd]
+        if readable:
+            data = os.read(infd, CHUNK_SIZE)
+            if data:
+                parts = splitter.split(data)
+            else:
+                parts = splitter.finish()
+                done = True
+            for fds, part in zip(outputs, parts):
+                if part:
+                    for fd in fds:
+                        queues[fd].append(memoryview(part))
+                        queued += len(part)
+            if done:
+                for fd, queue in list(queues.items()):
+                    if not queue:
+                        os.close(fd)
+                        del queues[fd]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distribute the FASTQ reads read from stdin to several named pipes.')
+    parser.add_argument('-1', dest='first', nargs='+', required=True, metavar='PIPE',
+                        help='Outputs of the first mate of paired reads, or of single end reads')
+    parser.add_argument('-2', dest='second', nargs='+', default=[], metavar='PIPE',
+                        help='Outputs of the second mate of paired reads')
+    parser.add_argument('--keep1', help='File to also keep the reads of the first mate in, compressed')
+    parser.add_argument('--keep2', help='File to also keep the reads of the second mate in, compressed')
+    parser.add_argument('--buffer-mb', type=int, default=512,
+                        help='Memory for reads the readers are not ready for, in MB [512]')
+    parser.add_argument('--gzip', default='gzip', help='Command compressing the kept reads [gzip]')
+    args = parser.parse_args()
+
+    if args.keep2 and not args.second:
+        parser.error('--keep2 needs outputs of the second mate (-2)')
+    mates = [(args.first, args.keep1), (args.second, args.keep2)] if args.second else [(args.first, args.keep1)]
+    # the pipes of both mates are opened together, in whatever order the
+    # readers open them
+    fds = open_outputs(args.first + args.second)
+    pipes = [fds[:len(args.first)], fds[len(args.first):]][:len(mates)]
+    keep = [compress_to(path, args.gzip) if path else None for _, path in mates]
+    outputs = [pipe + ([compressor[1]] if compressor else []) for pipe, compressor in zip(pipes, keep)]
+    fan_out(sys.stdin.fileno(), outputs, args.buffer_mb * 1024 * 1024)
+    for compressor in keep:
+        if compressor and compressor[0].wait() != 0:
+            sys.exit("ERROR: compressing the kept reads failed.")
@@ -0,0 +1,145 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Build a genome index in a shared cache directory, or reuse it.
+
+Cache entries are keyed by the checksums of the input files (e.g. the
+genome FASTA and the GTF file), the version of the indexing tool and
+the index arguments.  Concurrent builds of the same entry are
+serialized with a lock file: the first process builds the index while
+all others wait for it and then reuse it.  The files of the cached
+index are linked into the target directory of the project.
+
+Example:
+
+  python index_cache.py --cache-dir /shared/index_cache --name star_index \\
+      --target output/star_index --key-file genome.fa --key-file genes.gtf \\
+      --version-command 'STAR --version' -- \\
+      STAR --runMode genomeGenerate --genomeDir {index_dir} ...
+
+The string {index_dir} in the build command is replaced by the folder
+the index has to be built in.
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import argparse
+import subprocess
+
+def file_checksum(path, cache_dir):
+    """Return the SHA-256 checksum of the file at PATH.  Checksums are
+cached in CACHE_DIR by path, size and modification time."""
+    stat = os.stat(path)
+    key = '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime)
+    cache_file = os.path.join(cache_dir, 'checksums.json')
+    with open(cache_file + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache = {}
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as infile:
+                cache = json.load(infile)
+        if key not in cache:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as infile:
+                for chunk in iter(lambda: infile.read(1 << 20), b''):
+                    sha.update(chunk)
+            cache[key] = sha.hexdigest()
+            with open(cache_file + '.tmp', 'w') as outfile:
+                json.dump(cache, outfile)
+            os.rename(cache_file + '.tmp', cache_file)
+    return cache[key]
+
+def entry_key(key_files, version_command, key_strings, cache_dir):
+    """Compute the cache key from the checksums of KEY_FILES, the output
+of VERSION_COMMAND and the KEY_STRINGS."""
+    sha = hashlib.sha256()
+    for path in key_files:
+        sha.update(file_checksum(path, cache_dir).encode())
+    if version_command:
+        version = subprocess.check_output(version_command, shell=True, stderr=subprocess.STDOUT)
+        sha.update(version.strip())
+    for string in key_strings:
+        sha.update(string.encode())
+    return sha.hexdigest()
+
+def link_entry(entry, target):
+    """Link all files of the cache ENTRY into the TARGET folder."""
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(entry):
+        if name == '.complete':
+            continue
+        link = os.path.join(target, name)
+        if os.path.lexists(link):
+            if os.path.islink(link) and os.readlink(link) == os.path.join(entry, name):
+                continue
+            if os.path.isdir(link) and not os.path.islink(link):
+                shutil.rmtree(link)
+            else:
+                os.remove(link)
+        os.symlink(os.path.join(entry, name), link)
+
+def build_or_reuse(cache_dir, name, target, key, command):
+    """Link the cache entry NAME-KEY into TARGET, building it first with
+COMMAND if it does not exist yet."""
+    entry = os.path.join(cache_dir, '{}-{}'.format(name, key[:16]))
+    with open(entry + '.lock', 'a') as lock:
+        # Blocks while another process is building the same entry.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isfile(os.path.join(entry, '.complete')):
+            print('Reusing cached index {}'.format(entry), flush=True)
+        else:
+            building = '{}.tmp.{}'.format(entry, os.getpid())
+            shutil.rmtree(entry, ignore_errors=True)
+            os.makedirs(building)
+            print('Building index in {}'.format(entry), flush=True)
+            command = [arg.replace('{index_dir}', building) for arg in command]
+            status = subprocess.call(command)
+            if status != 0:
+                shutil.rmtree(building, ignore_errors=True)
+                raise Exception("ERROR: building the index failed with exit status {}.".format(status))
+            with open(os.path.join(building, '.complete'), 'w') as outfile:
+                outfile.write(key + '\n')
+            os.rename(building, entry)
+    link_entry(entry, target)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a genome index in a shared cache, or reuse it.')
+    parser.add_argument('--cache-dir', required=True, help='Shared index cache folder')
+    parser.add_argument('--name', required=True, help='Name of the index, e.g. star_index')
+    parser.add_argument('--target', required=True, help='Folder to link the index files into')
+    parser.add_argument('--key-file', action='append', default=[],
+                        help='Input file whose checksum is part of the cache key')
+    parser.add_argument('--key-string', action='append', default=[],
+                        help='Index arguments that are part of the cache key')
+    parser.add_argument('--version-command', default=None,
+                        help='Command printing the version of the indexing tool')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Command building the index in {index_dir}')
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('missing index build command')
+    cache_dir = os.path.abspath(args.cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = entry_key(args.key_file, args.version_command, args.key_string, cache_dir)
+    build_or_reuse(cache_dir, args.name, args.target, key, command)
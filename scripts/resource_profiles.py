@@ -0,0 +1,112 @@
+# PiGx RNAseq Pipeline.
+#
+# Copyright © 2026 BIMSB Bioinformatics Platform
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Resource profiles learned from the benchmark records of earlier runs.
+#
+# For every rule the profile holds one observation per job: the size of
+# the job's input (the bytes of the sample's reads files), the job's
+# peak memory, CPU time and wall time, and the time the job finished.
+# The memory of a new job is predicted from a linear fit of peak memory
+# against input size.  The profiles are stored in a JSON file that may
+# be shared by several projects; updates are serialized with a lock
+# file.  The benchmark records are read with summarize_benchmarks.py.
+
+import os
+import json
+import fcntl
+
+import summarize_benchmarks
+
+def memory_mb(size):
+    """Convert a memory size such as "16G" or "512M" to megabytes."""
+    size = str(size).strip().upper()
+    units = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size) / (1024 * 1024))
+
+def read_profiles(path):
+    """Return the resource profiles stored in PATH, or empty profiles."""
+    if path and os.path.isfile(path):
+        with open(path, 'r') as infile:
+            try:
+                return json.load(infile)
+            except ValueError:
+                pass
+    return {}
+
+def update_profiles(path, benchmark_dir, input_bytes, max_observations=500, skip_rules=()):
+    """Add the benchmark records found in BENCHMARK_DIR to the profiles
+stored in PATH.  INPUT_BYTES is a function mapping a rule and a target
+(e.g. a sample name, or '-' for rules run once) to the size of the
+job's input, or to None for jobs that are not to be profiled (such as
+those of samples no longer in the sample sheet).  Each benchmark file
+is one observation; records of jobs that were run again replace the
+earlier observation, and only the MAX_OBSERVATIONS most recent
+observations of every rule are kept.  Records of the rules in
+SKIP_RULES are ignored."""
+    records = []
+    for record in summarize_benchmarks.collect(benchmark_dir):
+        if record['rule'] in skip_rules or record['max_rss_mb'] is None:
+            continue
+        size = input_bytes(record['rule'], record['target'])
+        if size is None:
+            continue
+        records.append((record['rule'], record['path'],
+                        [size, record['max_rss_mb'], record['cpu_seconds'],
+                         record['wall_seconds'], os.stat(record['path']).st_mtime]))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        # Blocks while another pipeline updates the same profiles.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        profiles = read_profiles(path)
+        for rule, benchmark, observation in records:
+            profiles.setdefault(rule, {})[benchmark] = observation
+        for rule in set(rule for rule, _, _ in records):
+            observations = profiles[rule]
+            # observations of old profiles have no finishing time
+            recent = sorted(observations, key=lambda key: observations[key][4:5] or [0])
+            for key in recent[:-max_observations]:
+                del observations[key]
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as outfile:
+            json.dump(profiles, outfile)
+        os.rename(tmp, path)
+    return profiles
+
+def predict_memory(profiles, rule, size, margin=0.2, min_observations=3):
+    """Predict the memory (in MB) needed by a job of RULE with an input of
+SIZE bytes: the linear fit of the observed peak memory against input
+size, raised by the largest underestimate among the observations and
+by the relative safety MARGIN.  Return None if fewer than
+MIN_OBSERVATIONS jobs of RULE have been observed."""
+    points = [(o[0], o[1]) for o in profiles.get(rule, {}).values()
+              if o[0] is not None and o[1] is not None]
+    if len(points) < max(1, min_observations):
+        return None
+    n = float(len(points))
+    mean_size = sum(s for s, _ in points) / n
+    mean_rss = sum(r for _, r in points) / n
+    variance = sum((s - mean_size) ** 2 for s, _ in points)
+    slope = 0.0
+    if variance > 0:
+        slope = max(0.0, sum((s - mean_size) * (r - mean_rss) for s, r in points) / variance)
+    intercept = mean_rss - slope * mean_size
+    underestimate = max(0.0, max(r - (intercept + slope * s) for s, r in points))
+    return int((intercept + slope * size + underestimate) * (1 + margin)) + 1
@@ -0,0 +1,167 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Summarize the resource usage recorded for every job of a pipeline run.
+
+Every rule records the wall time, CPU time, peak memory and I/O of its
+jobs with Snakemake's benchmark directive, in
+
+  BENCHMARK_DIR/{rule}.tsv             (rules run once per project)
+  BENCHMARK_DIR/{rule}/{target}.tsv    (rules run per sample, analysis...)
+
+This script collects all these records into
+
+  OUT_DIR/performance_jobs.tsv    one line per job
+  OUT_DIR/performance_rules.tsv   totals and maxima per rule
+  OUT_DIR/performance_report.html both tables and the top offenders
+"""
+
+import os
+import csv
+import html
+import argparse
+
+FIELDS = ['rule', 'target', 'wall_seconds', 'cpu_seconds', 'max_rss_mb', 'io_in_mb', 'io_out_mb']
+
+def number(value):
+    """Convert a benchmark field to a float; missing values (NA or '-'),
+which Snakemake reports for very short jobs, become None."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_benchmark(path):
+    """Return the last record of the Snakemake benchmark file PATH as a
+dict with the keys of FIELDS (except rule and target)."""
+    with open(path, 'r') as infile:
+        rows = list(csv.DictReader(infile, delimiter='\t'))
+    if not rows:
+        return None
+    row = rows[-1]
+    wall = number(row.get('s'))
+    cpu = number(row.get('cpu_time'))
+    if cpu is None and wall is not None and number(row.get('mean_load')) is not None:
+        # Older Snakemake versions only report the mean CPU load (in %).
+        cpu = wall * number(row.get('mean_load')) / 100
+    return {'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'max_rss_mb': number(row.get('max_rss')),
+            'io_in_mb': number(row.get('io_in')),
+            'io_out_mb': number(row.get('io_out'))}
+
+def collect(benchmark_dir):
+    """Return one record per benchmark file found in BENCHMARK_DIR, with
+the rule, the target ('-' for rules run once) and the path of the
+file in addition to the fields of read_benchmark."""
+    records = []
+    for root, _, files in os.walk(benchmark_dir):
+        for name in sorted(files):
+            if not name.endswith('.tsv'):
+                continue
+            path = os.path.join(root, name)
+            record = read_benchmark(path)
+            if record is None:
+                continue
+            record['path'] = os.path.abspath(path)
+            target = name[:-len('.tsv')]
+            if os.path.abspath(root) == os.path.abspath(benchmark_dir):
+                record.update(rule=target, target='-')
+            else:
+                record.update(rule=os.path.relpath(root, benchmark_dir), target=target)
+            records.append(record)
+    return sorted(records, key=lambda r: (r['rule'], r['target']))
+
+def summarize_rules(records):
+    """Aggregate RECORDS per rule: number of jobs, total wall and CPU
+time, and the maxima of wall time and memory."""
+    rules = {}
+    for record in records:
+        entry = rules.setdefault(record['rule'], {'rule': record['rule'], 'jobs': 0,
+                                                  'total_wall_seconds': 0.0, 'total_cpu_seconds': 0.0,
+                                                  'max_wall_seconds': 0.0, 'max_rss_mb': 0.0,
+                                                  'total_io_in_mb': 0.0, 'total_io_out_mb': 0.0})
+        entry['jobs'] += 1
+        for total, field in [('total_wall_seconds', 'wall_seconds'), ('total_cpu_seconds', 'cpu_seconds'),
+                             ('total_io_in_mb', 'io_in_mb'), ('total_io_out_mb', 'io_out_mb')]:
+            entry[total] += record[field] or 0
+        entry['max_wall_seconds'] = max(entry['max_wall_seconds'], record['wall_seconds'] or 0)
+        entry['max_rss_mb'] = max(entry['max_rss_mb'], record['max_rss_mb'] or 0)
+    return sorted(rules.values(), key=lambda r: -r['total_wall_seconds'])
+
+def format_value(value):
+    if value is None:
+        return 'NA'
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
+
+def write_tsv(path, rows, fields):
+    with open(path, 'w') as outfile:
+        outfile.write('\t'.join(fields) + '\n')
+        for row in rows:
+            outfile.write('\t'.join(format_value(row[f]) for f in fields) + '\n')
+
+def html_table(rows, fields):
+    lines = ['<table>', '<tr>' + ''.join('<th>{}</th>'.format(html.escape(f)) for f in fields) + '</tr>']
+    for row in rows:
+        lines.append('<tr>' + ''.join('<td>{}</td>'.format(html.escape(format_value(row[f]))) for f in fields) + '</tr>')
+    lines.append('</table>')
+    return '\n'.join(lines)
+
+def write_html(path, records, rules, top):
+    rule_fields = list(rules[0].keys()) if rules else ['rule']
+    slowest = sorted(records, key=lambda r: -(r['wall_seconds'] or 0))[:top]
+    largest = sorted(records, key=lambda r: -(r['max_rss_mb'] or 0))[:top]
+    with open(path, 'w') as outfile:
+        outfile.write('\n'.join([
+            '<!DOCTYPE html>',
+            '<html><head><meta charset="utf-8"><title>PiGx RNAseq - Performance report</title>',
+            '<style>body {font-family: sans-serif} table {border-collapse: collapse; margin-bottom: 2em}'
+            ' th, td {border: 1px solid #ccc; padding: 2px 8px; text-align: right}'
+            ' th:first-child, td:first-child, td:nth-child(2) {text-align: left}</style>',
+            '</head><body>',
+            '<h1>PiGx RNAseq - Performance report</h1>',
+            '<p>{} jobs of {} rules.</p>'.format(len(records), len(rules)),
+            '<h2>Top {} jobs by wall time</h2>'.format(top), html_table(slowest, FIELDS),
+            '<h2>Top {} jobs by peak memory</h2>'.format(top), html_table(largest, FIELDS),
+            '<h2>Rules</h2>', html_table(rules, rule_fields),
+            '<h2>All jobs</h2>', html_table(records, FIELDS),
+            '</body></html>', '']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the recorded resource usage of all jobs.')
+    parser.add_argument('benchmark_dir', help='Folder holding the benchmark files of all rules')
+    parser.add_argument('out_dir', help='Folder to write the performance tables and report to')
+    parser.add_argument('--top', type=int, default=10, help='Number of top offenders to list [10]')
+    args = parser.parse_args()
+
+    records = collect(args.benchmark_dir)
+    rules = summarize_rules(records)
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_tsv(os.path.join(args.out_dir, 'performance_jobs.tsv'), records, FIELDS)
+    write_tsv(os.path.join(args.out_dir, 'performance_rules.tsv'), rules,
+              list(rules[0].keys()) if rules else ['rule'])
+    write_html(os.path.join(args.out_dir, 'performance_report.html'), records, rules, args.top)
+    if rules:
+        print("Slowest rules (total wall time):")
+        for rule in rules[:5]:
+            print("  - {}: {:.0f}s in {} job(s), peak memory {:.0f} MB".format(
+                rule['rule'], rule['total_wall_seconds'], rule['jobs'], rule['max_rss_mb']))
+    print("Performance report: {}".format(os.path.join(args.out_dir, 'performance_report.html')))
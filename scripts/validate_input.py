@@ -1,15 +1,154 @@
 import os
 import csv
+import gzip
+import json
+import zlib
 import yaml
+import inspect
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
-def read_sample_sheet(path):
-    with open(path, 'r') as fp:
-        rows =  [row for row in csv.reader(fp, delimiter=',')]
-        header = rows[0]; rows = rows[1:]
-        sample_sheet = [dict(zip(header, row)) for row in rows]
-    return sample_sheet
+class SampleRecord(object):
+    """One row of the sample sheet.  The column values are kept in a
+tuple; the column names are shared by all records of a registry."""
+    __slots__ = ('name', 'values', 'single_end', 'read_paths')
+
+    def __init__(self, name, values, single_end, read_paths):
+        self.name = name
+        self.values = values
+        self.single_end = single_end
+        self.read_paths = read_paths
+
+class SampleRegistry(object):
+    """The sample sheet, indexed by sample name.  Whether a sample is
+single or paired end and the full paths of its reads files are
+resolved once when the registry is built."""
+
+    def __init__(self, header, rows, reads_dir):
+        self.header = header
+        self.columns = {column: i for i, column in enumerate(header)}
+        self.records = []
+        self.index = {}
+        reads = self.columns.get('reads')
+        reads2 = self.columns.get('reads2')
+        for row in rows:
+            values = tuple(row)
+            name = values[self.columns['name']] if 'name' in self.columns else None
+            files = [values[i] for i in (reads, reads2) if i is not None and values[i]]
+            record = SampleRecord(name, values, len(files) == 1,
+                                  [os.path.join(reads_dir, f) for f in files])
+            if name in self.index:
+                raise Exception('ERROR: name "{}" is not unique. Replace it with a unique name in the sample_sheet.'.format(name))
+            self.index[name] = record
+            self.records.append(record)
+
+    @classmethod
+    def from_file(cls, path, reads_dir):
+        with open(path, 'r') as fp:
+            rows = [row for row in csv.reader(fp, delimiter=',')]
+        return cls(rows[0], rows[1:], reads_dir)
+
+    def __getitem__(self, name):
+        return self.index[name]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def names(self):
+        return [record.name for record in self.records]
+
+    def get(self, name, field):
+        """Return the value of the column FIELD for sample NAME."""
+        return self.index[name].values[self.columns[field]]
+
+    def lookup(self, column, predicate, fields=[]):
+        """Return the FIELDS of all records whose COLUMN matches the
+PREDICATE, which may be a function or a value.  Lookups by sample name
+use the index."""
+        if column == 'name' and not inspect.isfunction(predicate):
+            records = [self.index[predicate]] if predicate in self.index else []
+        elif inspect.isfunction(predicate):
+            records = [r for r in self.records if predicate(r.values[self.columns[column]])]
+        else:
+            records = [r for r in self.records if r.values[self.columns[column]] == predicate]
+        return [record.values[self.columns[field]] for record in records for field in fields]
+
+def scan_fastq(path):
+    """Stream through the (gzip compressed) FASTQ file at PATH.  Return
+the number of records and an error message, which is None if the file
+is intact."""
+    opener = gzip.open if path.endswith('.gz') else open
+    lines = 0
+    last = b'\n'
+    try:
+        with opener(path, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b''):
+                lines += chunk.count(b'\n')
+                last = chunk[-1:]
+    except (OSError, EOFError, zlib.error) as e:
+        return None, 'corrupt or truncated file {}: {}'.format(path, e)
+    if last != b'\n':
+        lines += 1
+    if lines == 0:
+        return 0, 'empty reads file: {}'.format(path)
+    if lines % 4 != 0:
+        return lines // 4, 'truncated FASTQ file {}: {} lines is not a multiple of 4'.format(path, lines)
+    return lines // 4, None
+
+def deep_validate_reads(registry, threads=4, cache_file=None):
+    """Check the content of all reads files of the samples in REGISTRY
+concurrently in THREADS worker threads: every file must decompress
+cleanly and hold complete FASTQ records, and both files of a paired end
+sample must hold the same number of records.  Results are cached in
+CACHE_FILE by path, size and modification time.  Return the list of
+all problems found."""
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file, 'r') as infile:
+            try:
+                cache = json.load(infile)
+            except ValueError:
+                cache = {}
+
+    def key(path):
+        stat = os.stat(path)
+        return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+    paths = sorted(set(path for record in registry for path in record.read_paths
+                       if os.path.isfile(path)))
+    keys = {path: key(path) for path in paths}
+    todo = [path for path in paths if keys[path] not in cache]
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        for path, result in zip(todo, executor.map(scan_fastq, todo)):
+            cache[keys[path]] = result
+
+    errors = []
+    for record in registry:
+        results = [cache[keys[path]] for path in record.read_paths if path in keys]
+        errors += [error for _, error in results if error]
+        counts = [count for count, error in results if not error]
+        if len(counts) == 2 and counts[0] != counts[1]:
+            errors.append('reads files of sample "{}" hold different numbers of records: {} ({}) and {} ({})'.format(
+                record.name, record.read_paths[0], counts[0], record.read_paths[1], counts[1]))
+
+    # validate_config runs whenever the Snakefile is parsed, also in
+    # concurrent cluster jobs: only write a changed cache, and replace it
+    # atomically so that readers never see a partial file
+    current = set(keys.values())
+    if cache_file and (todo or set(cache) != current):
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'w') as outfile:
+            json.dump({k: v for k, v in cache.items() if k in current}, outfile)
+        os.rename(tmp_file, cache_file)
+    return errors
 
 def read_config_file(path):
     with open(path, 'rt') as infile:
@@ -19,49 +158,63 @@ def read_config_file(path):
 def validate_config(config):
     # Check that all locations exist
     for loc in config['locations']:
-        if (not loc == 'output-dir') and (not (os.path.isdir(config['locations'][loc]) or os.path.isfile(config['locations'][loc]))):
+        if (not loc in ['output-dir', 'index-cache-dir']) and (not (os.path.isdir(config['locations'][loc]) or os.path.isfile(config['locations'][loc]))):
             raise Exception("ERROR: The following necessary directory/file does not exist: {} ({})".format(config['locations'][loc], loc))
 
-    sample_sheet = read_sample_sheet(config['locations']['sample-sheet'])
-    
     # Check if the required fields are found in the sample sheet
+    with open(config['locations']['sample-sheet'], 'r') as fp:
+        header = next(csv.reader(fp, delimiter=','))
     required_fields = set(['name', 'reads', 'reads2', 'sample_type'])
-    not_found = required_fields.difference(set(sample_sheet[0].keys()))
+    not_found = required_fields.difference(set(header))
     if len(not_found) > 0:
         raise Exception("ERROR: Required field(s) {} could not be found in the sample sheet file '{}'".format(not_found, config['locations']['sample-sheet']))
 
+    # Sample names are unique to each row
+    registry = SampleRegistry.from_file(config['locations']['sample-sheet'],
+                                        config['locations']['reads-dir'])
+
     # Check that requested analyses make sense
     if 'DEanalyses' in config:
+        sample_types = set(record.values[registry.columns['sample_type']] for record in registry)
         for analysis in config['DEanalyses']:
             for group in config['DEanalyses'][analysis]['case_sample_groups'] .split(',') + config['DEanalyses'][analysis]['control_sample_groups'].split(','):
                 group = group.strip() #remove any leading/trailing whitespaces in the sample group names
-                if not any(row['sample_type'] == group for row in sample_sheet):
+                if not group in sample_types:
                     raise Exception('ERROR: no samples in sample sheet have sample type {}, specified in analysis {}.'.format(group, analysis))
 
-    # Check that reads files exist; sample names are unique to each row; 
-    samples = {}        
-
-    for row in sample_sheet:
-        sample = row['name']
-        if sample in samples:
-            raise Exception('ERROR: name "{}" is not unique. Replace it with a unique name in the sample_sheet.'.format(sample))
-        else:
-            samples[sample] = 1
-                   
-        filenames = [row['reads'], row['reads2']] if row['reads2'] else [row['reads']]
+    # Check that reads files exist; report all missing files at once
+    errors = []
+    for record in registry:
+        reads, reads2 = (record.values[registry.columns[field]] for field in ('reads', 'reads2'))
+        filenames = [reads, reads2] if reads2 else [reads]
         for filename in filenames:
             fullpath = os.path.join(config['locations']['reads-dir'], filename)
             if not os.path.isfile(fullpath):
-                raise Exception('ERROR: missing reads file: {}'.format(fullpath))
+                errors.append('missing reads file: {}'.format(fullpath))
+
+    # Optionally check the content of the reads files
+    validation = config.get('execution', {}).get('validation', {})
+    if validation.get('deep', False):
+        cache_file = validation.get('cache') or os.path.join(config['locations']['output-dir'],
+                                                             'pigx_work', 'validation_cache.json')
+        errors += deep_validate_reads(registry, validation.get('threads', 4), cache_file)
+
+    if errors:
+        raise Exception('ERROR: ' + '\nERROR: '.join(errors))
+
+    return registry
 
-                    
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config-file', required=True, help='Path of configuration file [settings.yaml]')
     parser.add_argument('-s', '--sample-sheet-file', required=True, help='Path of sample sheet [sample_sheet.csv]')
+    parser.add_argument('--deep', action='store_true', help='Check the content of all reads files')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Number of files to check concurrently with --deep [4]')
     args = parser.parse_args()
 
     config = read_config_file(args.config_file)
     config['locations']['sample-sheet'] = args.sample_sheet_file
+    if args.deep:
+        config.setdefault('execution', {})['validation'] = {'deep': True, 'threads': args.threads}
     validate_config(config)
\ No newline at end of file
@@ -0,0 +1,81 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the collation of per-sample read count tables.
+
+Synthetic {sample}.read_counts.csv files are generated for increasing
+numbers of samples, and the wall time and peak memory (max RSS) of
+scripts/collate_read_counts.py are reported for each size.
+
+Usage: python tests/benchmarks/bench_collate_read_counts.py [--samples 100 1000 5000]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, '..', '..', 'scripts', 'collate_read_counts.py')
+
+def make_count_tables(folder, n_samples, n_features, seed=1):
+    rng = random.Random(seed)
+    features = ['ENSG{:011d}'.format(i) for i in range(n_features)]
+    rng.shuffle(features)
+    for s in range(n_samples):
+        name = 'sample_{:05d}'.format(s)
+        with open(os.path.join(folder, name + '.read_counts.csv'), 'w') as outfile:
+            outfile.write(',{}\n'.format(name))
+            for feature in features:
+                outfile.write('{},{}\n'.format(feature, rng.randint(0, 5000)))
+
+def run(command):
+    """Run COMMAND and return its wall time in seconds and max RSS in MB."""
+    start = time.time()
+    process = subprocess.Popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - start
+    if status != 0:
+        raise Exception("ERROR: command failed: {}".format(' '.join(command)))
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return elapsed, usage.ru_maxrss / scale
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--features', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=250)
+    args = parser.parse_args()
+
+    print('samples\tfeatures\tseconds\tmax_rss_mb')
+    for n in args.samples:
+        folder = tempfile.mkdtemp(prefix='pigx_bench_collate.')
+        try:
+            make_count_tables(folder, n, args.features)
+            out_file = os.path.join(folder, 'counts_from_star.tsv')
+            seconds, rss = run([sys.executable, SCRIPT, '--chunk-size', str(args.chunk_size),
+                                folder, out_file])
+            print('{}\t{}\t{:.2f}\t{:.1f}'.format(n, args.features, seconds, rss), flush=True)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
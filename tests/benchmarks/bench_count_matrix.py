@@ -0,0 +1,114 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the .cmat count matrix format against TSV.
+
+Synthetic count matrices are generated for increasing numbers of
+samples and written both as TSV and as .cmat file.  For each size the
+file sizes are reported, as well as the time to load the whole matrix
+and to load 10 columns from either file.  The matrices are loaded with
+scripts/count_matrix.py and, if Rscript is available, with
+readCountMatrix of scripts/count_matrix.R (which uses read.table for
+TSV files, like the pipeline's R scripts).
+
+Usage: python tests/benchmarks/bench_count_matrix.py [--samples 10 100 1000]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(HERE, '..', '..', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+from count_matrix import open_matrix, read_matrix
+
+def make_matrix(tsv_file, n_samples, n_features, seed=1):
+    """Write a raw count matrix as TSV and .cmat file."""
+    rng = random.Random(seed)
+    samples = ['sample_{:05d}'.format(s) for s in range(n_samples)]
+    with open_matrix(tsv_file, 'both', 'int32') as outfile:
+        outfile.write('\t'.join(samples) + '\n')
+        for i in range(n_features):
+            counts = (str(int(rng.expovariate(1 / 200.0))) if rng.random() < 0.6 else '0'
+                      for _ in samples)
+            outfile.write('ENSG{:011d}\t'.format(i) + '\t'.join(counts) + '\n')
+    return samples
+
+def read_tsv(path, columns=None):
+    with open(path, 'r') as infile:
+        header = infile.readline().rstrip('\n').split('\t')
+        keep = range(len(header)) if columns is None else [header.index(c) for c in columns]
+        rows = []
+        for line in infile:
+            fields = line.rstrip('\n').split('\t')
+            rows.append([int(fields[j + 1]) for j in keep])
+    return rows
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def r_timings(tsv_file, cmat_file, columns):
+    """Return the seconds R needs to load both files, in full and 10
+columns of them."""
+    program = ("source('{}'); cols <- c({}); "
+               "t <- function(e) unname(system.time(e)['elapsed']); "
+               "cat(t(readCountMatrix('{tsv}')), t(readCountMatrix('{cmat}')), "
+               "t(readCountMatrix('{tsv}', columns = cols)), t(readCountMatrix('{cmat}', columns = cols)))").format(
+                   os.path.join(SCRIPTS_DIR, 'count_matrix.R'),
+                   ', '.join("'{}'".format(c) for c in columns), tsv=tsv_file, cmat=cmat_file)
+    output = subprocess.check_output(['Rscript', '--vanilla', '-e', program])
+    return [float(x) for x in output.split()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--features', type=int, default=60000)
+    args = parser.parse_args()
+
+    with_r = shutil.which('Rscript') is not None
+    fields = ['samples', 'features', 'tsv_mb', 'cmat_mb',
+              'py_tsv_s', 'py_cmat_s', 'py_tsv_10cols_s', 'py_cmat_10cols_s']
+    if with_r:
+        fields += ['r_tsv_s', 'r_cmat_s', 'r_tsv_10cols_s', 'r_cmat_10cols_s']
+    print('\t'.join(fields))
+    for n in args.samples:
+        folder = tempfile.mkdtemp(prefix='pigx_bench_matrix.')
+        try:
+            tsv_file = os.path.join(folder, 'counts.tsv')
+            cmat_file = os.path.join(folder, 'counts.cmat')
+            samples = make_matrix(tsv_file, n, args.features)
+            columns = random.Random(2).sample(samples, min(10, n))
+            results = [n, args.features,
+                       os.path.getsize(tsv_file) / 2.0 ** 20, os.path.getsize(cmat_file) / 2.0 ** 20,
+                       timed(read_tsv, tsv_file), timed(read_matrix, cmat_file),
+                       timed(read_tsv, tsv_file, columns), timed(read_matrix, cmat_file, columns)]
+            if with_r:
+                results += r_timings(tsv_file, cmat_file, columns)
+            print('\t'.join(str(x) if isinstance(x, int) else '{:.2f}'.format(x) for x in results), flush=True)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
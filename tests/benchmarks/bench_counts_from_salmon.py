@@ -0,0 +1,80 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the collation of SALMON quantifications.
+
+Synthetic quant.sf and quant.genes.sf files are generated for
+increasing numbers of samples, and the wall time and peak memory (max
+RSS) of scripts/counts_matrix_from_SALMON.py are reported for each size.
+
+Usage: python tests/benchmarks/bench_counts_from_salmon.py [--samples 100 500 1000]
+"""
+
+import os
+import sys
+import random
+import shutil
+import argparse
+import tempfile
+
+from bench_collate_read_counts import run
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, '..', '..', 'scripts', 'counts_matrix_from_SALMON.py')
+
+def write_quant_file(path, names, rng):
+    with open(path, 'w') as outfile:
+        outfile.write('Name\tLength\tEffectiveLength\tTPM\tNumReads\n')
+        for name in names:
+            reads = rng.random() * 1000 if rng.random() < 0.4 else 0
+            outfile.write('{}\t1500\t1330.000\t{:.6f}\t{:.3f}\n'.format(name, reads * 0.37, reads))
+
+def make_salmon_output(folder, n_samples, n_transcripts, seed=1):
+    rng = random.Random(seed)
+    transcripts = ['ENST{:011d}'.format(i) for i in range(n_transcripts)]
+    genes = ['ENSG{:011d}'.format(i) for i in range(n_transcripts // 4)]
+    rng.shuffle(transcripts)
+    with open(os.path.join(folder, 'colData.tsv'), 'w') as col_data:
+        col_data.write('"sample_type"\t"group"\n')
+        for s in range(n_samples):
+            name = 'sample_{:05d}'.format(s)
+            col_data.write('"{0}"\t"g{1}"\t"g{1}"\n'.format(name, s % 2))
+            os.makedirs(os.path.join(folder, 'salmon_output', name))
+            write_quant_file(os.path.join(folder, 'salmon_output', name, 'quant.sf'), transcripts, rng)
+            write_quant_file(os.path.join(folder, 'salmon_output', name, 'quant.genes.sf'), genes, rng)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, nargs='+', default=[100, 500, 1000])
+    parser.add_argument('--transcripts', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=250)
+    args = parser.parse_args()
+
+    print('samples\ttranscripts\tseconds\tmax_rss_mb')
+    for n in args.samples:
+        folder = tempfile.mkdtemp(prefix='pigx_bench_salmon.')
+        try:
+            make_salmon_output(folder, n, args.transcripts)
+            seconds, rss = run([sys.executable, SCRIPT, '--chunk-size', str(args.chunk_size),
+                                os.path.join(folder, 'salmon_output'),
+                                os.path.join(folder, 'feature_counts'),
+                                os.path.join(folder, 'colData.tsv')])
+            print('{}\t{}\t{:.2f}\t{:.1f}'.format(n, args.transcripts, seconds, rss), flush=True)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
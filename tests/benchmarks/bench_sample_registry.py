@@ -0,0 +1,92 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark DAG construction for large sample sheets.
+
+A synthetic project (see synthetic_project.py) is generated for
+increasing numbers of samples, and the wall time and peak memory of
+"snakemake --dryrun" building the DAG of the final report are reported
+for each size.  With --revisions, the Snakefile and scripts of each
+given git revision are timed on the same project, e.g. the revision
+before the sample sheet was indexed by name and the current one.  The
+empty revision '' stands for the working tree.
+
+Requires snakemake on the PATH; runs offline.
+
+Usage: python tests/benchmarks/bench_sample_registry.py [--samples 1000 10000] [--revisions b978139 '']
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from bench_collate_read_counts import run
+from synthetic_project import ROOT, make_project, make_config
+
+def source_tree(revision, folder):
+    """Return the source tree of the git REVISION, extracted into FOLDER,
+or the working tree for the empty revision."""
+    if not revision:
+        return ROOT
+    tree = os.path.join(folder, 'source-' + revision)
+    os.makedirs(tree)
+    archive = subprocess.Popen(['git', '-C', ROOT, 'archive', revision], stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', tree], stdin=archive.stdout)
+    if archive.wait() != 0:
+        raise Exception("ERROR: cannot extract revision {}.".format(revision))
+    return tree
+
+def dry_run(folder, settings, tree):
+    """Build the DAG of the project in FOLDER with the Snakefile of TREE
+and return the wall time in seconds and the max RSS in MB."""
+    output_dir = settings['locations']['output-dir']
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    return run(['snakemake', '--snakefile', os.path.join(tree, 'pigx_rnaseq.py'),
+                '--configfile', make_config(folder, settings, root=tree),
+                '--directory', output_dir, '--dryrun', '--quiet'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--reads', type=int, default=100, help='Reads (or pairs) per sample [100]')
+    parser.add_argument('--revisions', nargs='+', default=[''],
+                        help="Git revisions to time; '' is the working tree ['']")
+    args = parser.parse_args()
+
+    if not shutil.which('snakemake'):
+        sys.exit("ERROR: snakemake is needed to build the DAG.")
+
+    print('revision\tsamples\tseconds\tmax_rss_mb')
+    folder = tempfile.mkdtemp(prefix='pigx_bench_dag.')
+    try:
+        trees = [(revision, source_tree(revision, folder)) for revision in args.revisions]
+        for n in args.samples:
+            project = os.path.join(folder, 'project-{}'.format(n))
+            os.makedirs(project)
+            settings = make_project(project, n, args.reads)
+            for revision, tree in trees:
+                seconds, rss = dry_run(project, settings, tree)
+                print('{}\t{}\t{:.2f}\t{:.1f}'.format(revision or 'working-tree', n, seconds, rss), flush=True)
+            shutil.rmtree(project, ignore_errors=True)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
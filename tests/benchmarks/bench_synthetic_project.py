@@ -0,0 +1,178 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the pipeline's own glue code on synthetic projects.
+
+For increasing numbers of samples a synthetic project is generated
+(see synthetic_project.py): a small genome with its GTF and cDNA
+files, a sample sheet with paired and single end samples, simulated
+reads files, per-sample read count tables and SALMON quantifications.  The following stages are timed;
+none of them needs STAR, SALMON or any other mapping tool:
+
+  validate_config       checking the settings and the sample sheet
+  validate_config_deep  the same, decompressing all reads files
+  dag                   building the DAG (snakemake --dryrun)
+  collate_read_counts   scripts/collate_read_counts.py
+  counts_from_SALMON    scripts/counts_matrix_from_SALMON.py
+  norm_counts_deseq     size factor normalization (scripts/norm_counts_deseq.R)
+
+Stages whose requirements (snakemake, Rscript with DESeq2) are missing
+are skipped.  Every result is appended to the --record file together
+with the date, host and git commit, and compared with the best earlier
+result of the same stage and size on the same host; slowdowns beyond
+--tolerance (and --min-seconds, to ignore the noise of short stages)
+are reported as regressions, and the exit status is then 1.
+Everything runs offline.
+
+Usage: python tests/benchmarks/bench_synthetic_project.py [--samples 10 50 200]
+       python tests/benchmarks/bench_synthetic_project.py --generate-only DIR --samples 20
+"""
+
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from bench_collate_read_counts import make_count_tables, run
+from bench_counts_from_salmon import make_salmon_output
+from synthetic_project import ROOT, make_project, make_config
+
+SCRIPTS_DIR = os.path.join(ROOT, 'scripts')
+
+RECORD_FIELDS = ['date', 'host', 'commit', 'stage', 'samples', 'seconds', 'max_rss_mb']
+
+# Run validate_config on the JSON config file given as first argument.
+VALIDATE = """
+import sys, json, runpy
+config = json.load(open(sys.argv[1]))
+runpy.run_path(sys.argv[2])['validate_config'](config)
+"""
+
+def has_deseq2():
+    if not shutil.which('Rscript'):
+        return False
+    return subprocess.call(['Rscript', '--vanilla', '-e', 'quit(status = !requireNamespace("DESeq2", quietly = TRUE))'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+def stages(folder, n, args):
+    """Yield the name and the command of every stage to time for the
+project of N samples in FOLDER, generating the inputs of each."""
+    settings = make_project(folder, n, args.reads)
+    validate_input = os.path.join(SCRIPTS_DIR, 'validate_input.py')
+    yield 'validate_config', [sys.executable, '-c', VALIDATE, make_config(folder, settings), validate_input]
+    yield 'validate_config_deep', [sys.executable, '-c', VALIDATE, make_config(folder, settings, deep=True), validate_input]
+    if shutil.which('snakemake'):
+        yield 'dag', ['snakemake', '--snakefile', os.path.join(ROOT, 'pigx_rnaseq.py'),
+                      '--configfile', make_config(folder, settings),
+                      '--directory', settings['locations']['output-dir'],
+                      '--dryrun', '--quiet']
+
+    counts_dir = os.path.join(folder, 'read_counts')
+    os.makedirs(counts_dir)
+    make_count_tables(counts_dir, n, args.features)
+    yield 'collate_read_counts', [sys.executable, os.path.join(SCRIPTS_DIR, 'collate_read_counts.py'),
+                                  counts_dir, os.path.join(folder, 'counts_from_star.tsv')]
+
+    make_salmon_output(folder, n, args.transcripts)
+    yield 'counts_from_SALMON', [sys.executable, os.path.join(SCRIPTS_DIR, 'counts_matrix_from_SALMON.py'),
+                                 os.path.join(folder, 'salmon_output'), os.path.join(folder, 'feature_counts'),
+                                 os.path.join(folder, 'colData.tsv')]
+
+    if has_deseq2():
+        yield 'norm_counts_deseq', ['Rscript', '--vanilla', os.path.join(SCRIPTS_DIR, 'norm_counts_deseq.R'),
+                                    os.path.join(folder, 'counts_from_star.tsv'),
+                                    os.path.join(folder, 'colData.tsv'), folder]
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return '-'
+
+def read_record(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r') as infile:
+        return list(csv.DictReader(infile, delimiter='\t'))
+
+def best_earlier(records, host, stage, samples):
+    seconds = [float(r['seconds']) for r in records
+               if r['host'] == host and r['stage'] == stage and r['samples'] == str(samples)]
+    return min(seconds) if seconds else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--reads', type=int, default=2000, help='Reads (or pairs) per sample [2000]')
+    parser.add_argument('--features', type=int, default=20000, help='Genes in the read count tables [20000]')
+    parser.add_argument('--transcripts', type=int, default=60000, help='Transcripts in the SALMON files [60000]')
+    parser.add_argument('--record', default='bench_synthetic_project.tsv',
+                        help='File to append the results to [bench_synthetic_project.tsv]')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative slowdown against the best earlier result reported as regression [0.25]')
+    parser.add_argument('--min-seconds', type=float, default=0.5,
+                        help='Smallest absolute slowdown reported as regression [0.5]')
+    parser.add_argument('--generate-only', metavar='DIR',
+                        help='Only generate a project with the first --samples number of samples in DIR')
+    args = parser.parse_args()
+
+    if args.generate_only:
+        os.makedirs(args.generate_only, exist_ok=True)
+        make_project(os.path.abspath(args.generate_only), args.samples[0], args.reads)
+        sys.exit(0)
+
+    earlier = read_record(args.record)
+    host = platform.node()
+    commit = git_commit()
+    date = time.strftime('%Y-%m-%d %H:%M:%S')
+    new_record = not os.path.isfile(args.record)
+    regressions = 0
+    print('stage\tsamples\tseconds\tmax_rss_mb\tbest_earlier\tchange')
+    with open(args.record, 'a') as record:
+        writer = csv.DictWriter(record, RECORD_FIELDS, delimiter='\t', lineterminator='\n')
+        if new_record:
+            writer.writeheader()
+        for n in args.samples:
+            folder = tempfile.mkdtemp(prefix='pigx_bench_project.')
+            try:
+                for stage, command in stages(folder, n, args):
+                    seconds, rss = run(command)
+                    best = best_earlier(earlier, host, stage, n)
+                    change = ''
+                    if best:
+                        change = '{:+.0%}'.format(seconds / best - 1)
+                        if seconds > best * (1 + args.tolerance) and seconds - best > args.min_seconds:
+                            change += ' REGRESSION'
+                            regressions += 1
+                    writer.writerow({'date': date, 'host': host, 'commit': commit, 'stage': stage,
+                                     'samples': n, 'seconds': '{:.3f}'.format(seconds),
+                                     'max_rss_mb': '{:.1f}'.format(rss)})
+                    record.flush()
+                    print('{}\t{}\t{:.2f}\t{:.1f}\t{}\t{}'.format(stage, n, seconds, rss,
+                                                                 '{:.2f}'.format(best) if best else '-', change),
+                          flush=True)
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+    sys.exit(1 if regressions else 0)
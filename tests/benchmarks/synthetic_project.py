@@ -0,0 +1,170 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generate synthetic projects for the benchmarks: a small genome with
+its GTF and cDNA files, simulated reads, a sample sheet and settings,
+and the configuration the launcher would write for them.
+"""
+
+import os
+import re
+import csv
+import gzip
+import json
+import time
+import yaml
+import bisect
+import random
+import itertools
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+def random_sequence(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+def make_genome(folder, n_chromosomes=3, chromosome_length=50000, genes_per_chromosome=40, seed=1):
+    """Write sample.fasta, sample.cdna.fasta and sample.gtf to FOLDER:
+chromosomes with two-exon genes of one transcript each.  Return the
+transcript sequences."""
+    rng = random.Random(seed)
+    transcripts = {}
+    with open(os.path.join(folder, 'sample.fasta'), 'w') as fasta, \
+         open(os.path.join(folder, 'sample.gtf'), 'w') as gtf:
+        for c in range(n_chromosomes):
+            chromosome = 'chr{}'.format(c + 1)
+            sequence = random_sequence(rng, chromosome_length)
+            fasta.write('>{}\n'.format(chromosome))
+            for i in range(0, len(sequence), 60):
+                fasta.write(sequence[i:i + 60] + '\n')
+            slot = chromosome_length // genes_per_chromosome
+            for g in range(genes_per_chromosome):
+                gene = 'GENE{:02d}{:04d}'.format(c + 1, g)
+                transcript = gene.replace('GENE', 'TRAN')
+                strand = rng.choice('+-')
+                start = g * slot + 1
+                exons = [(start, start + slot // 3), (start + slot // 2, start + slot - 10)]
+                attributes = 'gene_id "{0}"; gene_name "{0}"; gene_biotype "protein_coding";'.format(gene)
+                gtf.write('\t'.join([chromosome, 'synthetic', 'gene', str(exons[0][0]), str(exons[-1][1]),
+                                     '.', strand, '.', attributes]) + '\n')
+                attributes += ' transcript_id "{}";'.format(transcript)
+                gtf.write('\t'.join([chromosome, 'synthetic', 'transcript', str(exons[0][0]), str(exons[-1][1]),
+                                     '.', strand, '.', attributes]) + '\n')
+                for e, (first, last) in enumerate(exons):
+                    gtf.write('\t'.join([chromosome, 'synthetic', 'exon', str(first), str(last), '.', strand, '.',
+                                         attributes + ' exon_number "{}";'.format(e + 1)]) + '\n')
+                spliced = ''.join(sequence[first - 1:last] for first, last in exons)
+                transcripts[transcript] = spliced if strand == '+' else reverse_complement(spliced)
+    with open(os.path.join(folder, 'sample.cdna.fasta'), 'w') as cdna:
+        for name, sequence in transcripts.items():
+            cdna.write('>{}\n'.format(name))
+            for i in range(0, len(sequence), 60):
+                cdna.write(sequence[i:i + 60] + '\n')
+    return transcripts
+
+def write_reads(paths, transcripts, n_reads, read_length, rng):
+    """Write N_READS simulated reads (pairs, if two PATHS are given) drawn
+from TRANSCRIPTS to gzipped FASTQ files."""
+    names = sorted(transcripts)
+    # cumulative expression weights; random.choices needs Python 3.6
+    cumulative = list(itertools.accumulate(rng.expovariate(1.0) for _ in names))
+    outfiles = [gzip.open(path, 'wt', compresslevel=1) for path in paths]
+    quality = 'I' * read_length
+    try:
+        for i in range(n_reads):
+            pick = bisect.bisect(cumulative, rng.random() * cumulative[-1])
+            sequence = transcripts[names[min(pick, len(names) - 1)]]
+            fragment = min(len(sequence), rng.randint(2 * read_length, 3 * read_length))
+            start = rng.randint(0, len(sequence) - fragment)
+            mates = [sequence[start:start + read_length],
+                     reverse_complement(sequence[start + fragment - read_length:start + fragment])]
+            for mate, outfile in enumerate(outfiles):
+                outfile.write('@read{}/{}\n{}\n+\n{}\n'.format(i, mate + 1, mates[mate], quality))
+    finally:
+        for outfile in outfiles:
+            outfile.close()
+
+def make_project(folder, n_samples, reads_per_sample=2000, read_length=75, seed=1):
+    """Generate a synthetic project in FOLDER: genome, annotation, reads
+(every third sample single end) and sample sheet, and the settings
+file settings.yaml pointing to them.  Return the settings."""
+    rng = random.Random(seed)
+    reads_dir = os.path.join(folder, 'reads')
+    os.makedirs(reads_dir, exist_ok=True)
+    transcripts = make_genome(folder)
+    with open(os.path.join(folder, 'sample_sheet.csv'), 'w') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['name', 'reads', 'reads2', 'sample_type'])
+        for s in range(n_samples):
+            name = 'sample_{:05d}'.format(s)
+            files = [name + '.read1.fastq.gz'] + ([name + '.read2.fastq.gz'] if s % 3 else [])
+            write_reads([os.path.join(reads_dir, f) for f in files], transcripts,
+                        reads_per_sample, read_length, rng)
+            writer.writerow([name, files[0], files[1] if len(files) > 1 else '', 'g{}'.format(s % 2)])
+    settings = {
+        'locations': {
+            'reads-dir': reads_dir,
+            'output-dir': os.path.join(folder, 'output'),
+            'genome-fasta': os.path.join(folder, 'sample.fasta'),
+            'cdna-fasta': os.path.join(folder, 'sample.cdna.fasta'),
+            'gtf-file': os.path.join(folder, 'sample.gtf')
+        },
+        'organism': '',
+        'DEanalyses': {
+            'analysis1': {
+                'case_sample_groups': 'g1',
+                'control_sample_groups': 'g0',
+                'covariates': ''
+            }
+        }
+    }
+    with open(os.path.join(folder, 'settings.yaml'), 'w') as outfile:
+        yaml.safe_dump(settings, outfile, default_flow_style=False)
+    return settings
+
+def merge(defaults, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(defaults.get(key), dict):
+            merge(defaults[key], value)
+        else:
+            defaults[key] = value
+    return defaults
+
+def make_config(folder, settings, deep=False, root=ROOT):
+    """Write the configuration the launcher would generate for the
+project in FOLDER, with the default settings of etc/settings.yaml.in
+of the source tree ROOT and the tools looked up on the PATH, and return
+its file name."""
+    with open(os.path.join(root, 'etc', 'settings.yaml.in'), 'r') as infile:
+        text = re.sub(r'@([A-Z_]+)@', lambda m: m.group(1).lower().replace('_', '-'), infile.read())
+    config = merge(yaml.safe_load(text), json.loads(json.dumps(settings)))
+    config['execution']['target'] = None
+    if 'validation' in config['execution']:
+        config['execution']['validation']['deep'] = deep
+        config['execution']['validation']['cache'] = os.path.join(folder, 'validation_cache.{}.json'.format(time.time()))
+    config['locations'].update({
+        'pkglibexecdir': root,
+        'pkgdatadir': root,
+        'sample-sheet': os.path.join(folder, 'sample_sheet.csv')
+    })
+    path = os.path.join(folder, 'config.deep.json' if deep else 'config.json')
+    with open(path, 'w') as outfile:
+        json.dump(config, outfile, indent=4, sort_keys=True)
+    return path
@@ -0,0 +1,125 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/collate_read_counts.py."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts'))
+
+import collate_read_counts
+from count_matrix import read_matrix
+
+def write_table(folder, sample, rows):
+    path = os.path.join(folder, sample + '.read_counts.csv')
+    with open(path, 'w') as outfile:
+        outfile.write('feature,{}\n'.format(sample))
+        for feature, count in rows:
+            outfile.write('{},{}\n'.format(feature, count))
+    return path
+
+def read_lines(path):
+    with open(path, 'r') as infile:
+        return infile.read().splitlines()
+
+class CollateReadCountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_collate.')
+        self.out_file = os.path.join(self.folder, 'counts.tsv')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_find_count_files(self):
+        write_table(self.folder, 'b', [])
+        write_table(self.folder, 'a', [])
+        open(os.path.join(self.folder, 'a.read_counts.csv.log'), 'w').close()
+        open(os.path.join(self.folder, 'notes.txt'), 'w').close()
+        names = [os.path.basename(f) for f in collate_read_counts.find_count_files(self.folder)]
+        self.assertEqual(names, ['a.read_counts.csv', 'b.read_counts.csv'])
+
+    def test_single_table_keeps_file_order(self):
+        table = write_table(self.folder, 's1', [('g2', 5), ('g1', 3)])
+        collate_read_counts.collate([table], self.out_file, 10)
+        self.assertEqual(read_lines(self.out_file), ['s1', 'g2\t5', 'g1\t3'])
+
+    def test_merge_follows_first_table(self):
+        tables = [write_table(self.folder, 's1', [('g2', 5), ('g1', 3), ('g3', 0)]),
+                  write_table(self.folder, 's2', [('g3', 7), ('g1', 1), ('g9', 4)])]
+        collate_read_counts.collate(tables, self.out_file, 10)
+        # rows sorted by feature id, missing features are NA and
+        # features unknown to the first table are dropped
+        self.assertEqual(read_lines(self.out_file),
+                         ['s1\ts2', 'g1\t3\t1', 'g2\t5\tNA', 'g3\t0\t7'])
+
+    def test_chunk_size_does_not_change_the_matrix(self):
+        tables = [write_table(self.folder, 's{}'.format(i), [('g{}'.format(j), i * j) for j in range(5)])
+                  for i in range(7)]
+        collate_read_counts.collate(tables, self.out_file, 100)
+        expected = read_lines(self.out_file)
+        for chunk_size in (1, 2, 3):
+            collate_read_counts.collate(tables, self.out_file, chunk_size)
+            self.assertEqual(read_lines(self.out_file), expected)
+
+    def test_chunks_are_reused(self):
+        chunk_dir = os.path.join(self.folder, 'chunks')
+        tables = [write_table(self.folder, 's{}'.format(i), [('g1', i), ('g2', 2 * i)]) for i in range(4)]
+        collate_read_counts.collate(tables, self.out_file, 2, chunk_dir)
+        first = os.path.join(chunk_dir, sorted(f for f in os.listdir(chunk_dir) if f.startswith('chunk_'))[0])
+        mtime = os.stat(first).st_mtime_ns
+
+        tables.append(write_table(self.folder, 's4', [('g1', 4), ('g2', 8)]))
+        chunks = collate_read_counts.collate(tables, self.out_file, 2, chunk_dir)
+        self.assertIn(first, chunks)
+        self.assertEqual(os.stat(first).st_mtime_ns, mtime)
+        self.assertEqual(read_lines(self.out_file),
+                         ['s0\ts1\ts2\ts3\ts4', 'g1\t0\t1\t2\t3\t4', 'g2\t0\t2\t4\t6\t8'])
+        # stale chunks are removed
+        self.assertEqual(sorted(os.path.basename(c) for c in chunks),
+                         sorted(f for f in os.listdir(chunk_dir) if f.startswith('chunk_')))
+
+    def test_modified_table_is_read_again(self):
+        chunk_dir = os.path.join(self.folder, 'chunks')
+        tables = [write_table(self.folder, 's{}'.format(i), [('g1', i)]) for i in range(2)]
+        collate_read_counts.collate(tables, self.out_file, 1, chunk_dir)
+        write_table(self.folder, 's1', [('g1', 42), ('g0', 1)])
+        os.utime(tables[1], (0, 0))
+        collate_read_counts.collate(tables, self.out_file, 1, chunk_dir)
+        self.assertEqual(read_lines(self.out_file), ['s0\ts1', 'g1\t0\t42'])
+
+    def test_binary_format(self):
+        tables = [write_table(self.folder, 's1', [('g1', 3), ('g2', 5)]),
+                  write_table(self.folder, 's2', [('g2', 1)])]
+        collate_read_counts.collate(tables, self.out_file, 10, matrix_format='both')
+        rows, columns, values = read_matrix(os.path.join(self.folder, 'counts.cmat'))
+        self.assertEqual(rows, ['g1', 'g2'])
+        self.assertEqual(columns, ['s1', 's2'])
+        self.assertEqual([list(v) for v in values], [[3, 5], [-2 ** 31, 1]])
+        self.assertEqual(read_lines(self.out_file), ['s1\ts2', 'g1\t3\tNA', 'g2\t5\t1'])
+
+    def test_no_tables(self):
+        with self.assertRaises(Exception):
+            collate_read_counts.collate([], self.out_file, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/count_matrix.py."""
+
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts'))
+
+import count_matrix
+
+def matrix_text(rows, columns, values):
+    lines = ['\t'.join(columns)]
+    for i, row in enumerate(rows):
+        lines.append(row + '\t' + '\t'.join(values[j][i] for j in range(len(columns))))
+    return '\n'.join(lines) + '\n'
+
+class CountMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_cmat.')
+        self.path = os.path.join(self.folder, 'm.cmat')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, text, dtype, block_rows=None, pieces=1):
+        writer = count_matrix.MatrixWriter(self.path, dtype, block_rows)
+        size = len(text) // pieces + 1
+        for start in range(0, len(text), size):
+            writer.write(text[start:start + size])
+        writer.close()
+
+    def test_matrix_files(self):
+        self.assertEqual(count_matrix.matrix_files('a/b.tsv', 'tsv'), ['a/b.tsv'])
+        self.assertEqual(count_matrix.matrix_files('a/b.tsv', 'binary'), ['a/b.cmat'])
+        self.assertEqual(count_matrix.matrix_files('a/b.tsv', 'both'), ['a/b.tsv', 'a/b.cmat'])
+
+    def test_int32_round_trip(self):
+        rows = ['g{}'.format(i) for i in range(10)]
+        values = [[str(i * j) for i in range(10)] for j in range(3)]
+        values[1][4] = 'NA'
+        # small blocks and text split across writes and lines
+        self.write(matrix_text(rows, ['a', 'b', 'c'], values), 'int32', block_rows=3, pieces=7)
+        row_names, columns, read = count_matrix.read_matrix(self.path)
+        self.assertEqual(row_names, rows)
+        self.assertEqual(columns, ['a', 'b', 'c'])
+        self.assertEqual([[count_matrix.format_value(v) for v in column] for column in read], values)
+
+    def test_float64_round_trip(self):
+        values = [['0.5', '1e-20', 'NA'], ['123456.789', '-2', '3.14159265358979']]
+        self.write(matrix_text(['x', 'y', 'z'], ['a', 'b'], values), 'float64')
+        _, _, read = count_matrix.read_matrix(self.path)
+        self.assertEqual(list(read[0][:2]), [0.5, 1e-20])
+        self.assertTrue(math.isnan(read[0][2]))
+        self.assertEqual([count_matrix.format_value(v) for v in read[1]], values[1])
+
+    def test_select_rows_and_columns(self):
+        rows = ['g{}'.format(i) for i in range(20)]
+        values = [[str(100 * j + i) for i in range(20)] for j in range(4)]
+        self.write(matrix_text(rows, ['a', 'b', 'c', 'd'], values), 'int32', block_rows=4)
+        row_names, columns, read = count_matrix.read_matrix(self.path, ['d', 'b'], ['g17', 'g2', 'g3'])
+        self.assertEqual(row_names, ['g17', 'g2', 'g3'])
+        self.assertEqual(columns, ['d', 'b'])
+        self.assertEqual([list(column) for column in read], [[317, 302, 303], [117, 102, 103]])
+
+    def test_open_matrix_writes_all_formats(self):
+        tsv_file = os.path.join(self.folder, 'm.tsv')
+        text = matrix_text(['g1', 'g2'], ['a'], [['1', '2']])
+        with count_matrix.open_matrix(tsv_file, 'both', 'int32') as outfile:
+            outfile.write(text)
+        with open(tsv_file, 'r') as infile:
+            self.assertEqual(infile.read(), text)
+        self.assertEqual(list(count_matrix.read_matrix(self.path)[2][0]), [1, 2])
+
+    def test_ragged_row(self):
+        writer = count_matrix.MatrixWriter(self.path, 'int32')
+        writer.write('a\tb\n')
+        with self.assertRaises(Exception):
+            writer.write('g1\t1\n')
+        writer.out.close()
+
+    def test_not_a_matrix(self):
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'not a count matrix at all')
+        with self.assertRaises(Exception):
+            count_matrix.read_matrix(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/counts_matrix_from_SALMON.py."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts'))
+
+import counts_matrix_from_SALMON
+
+def write_quant(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write('Name\tLength\tEffectiveLength\tTPM\tNumReads\n')
+        for name, tpm, reads in rows:
+            outfile.write('{}\t1000\t800\t{}\t{}\n'.format(name, tpm, reads))
+
+def read_lines(path):
+    with open(path, 'r') as infile:
+        return infile.read().splitlines()
+
+class CountsMatrixFromSalmonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_salmon.')
+        self.salmon_dir = os.path.join(self.folder, 'salmon_output')
+        self.counts_dir = os.path.join(self.folder, 'counts')
+        os.makedirs(self.counts_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def add_sample(self, sample, transcripts, genes):
+        write_quant(os.path.join(self.salmon_dir, sample, 'quant.sf'), transcripts)
+        write_quant(os.path.join(self.salmon_dir, sample, 'quant.genes.sf'), genes)
+
+    def output(self, kind, level):
+        folder, prefix = {'counts': ('raw_counts', ''), 'tpm': ('normalized', 'TPM_')}[kind]
+        return read_lines(os.path.join(self.counts_dir, folder, '{}counts_from_SALMON.{}.tsv'.format(prefix, level)))
+
+    def test_read_samples(self):
+        col_data = os.path.join(self.folder, 'colData.tsv')
+        with open(col_data, 'w') as outfile:
+            outfile.write('"group"\t"batch"\ns2\tA\t1\ns1\tB\t1\n\n')
+        self.assertEqual(counts_matrix_from_SALMON.read_samples(col_data), ['s2', 's1'])
+
+    def test_format_number(self):
+        fmt = counts_matrix_from_SALMON.format_number
+        self.assertEqual([fmt(v) for v in [0, 1.0, 0.5, 123456.789, 1e-20, 1e20, 1234567890123456789.0, 0.1 + 0.2]],
+                         ['0', '1', '0.5', '123456.789', '1e-20', '1e+20', '1234567890123456768', '0.3'])
+        self.assertEqual(counts_matrix_from_SALMON.format_count(2.5), '2')
+        self.assertEqual(counts_matrix_from_SALMON.format_count(3.6), '4')
+
+    def test_collate(self):
+        self.add_sample('s1', [('t2', 10.5, 3.4), ('t1', 0, 0)], [('g1', 10.5, 3.4)])
+        self.add_sample('s2', [('t2', 1, 7.6), ('t1', 2.25, 1)], [('g1', 3.25, 8.6)])
+        for chunk_size in (1, 10):
+            counts_matrix_from_SALMON.collate(self.salmon_dir, ['s1', 's2'], self.counts_dir, chunk_size)
+            # raw counts keep the row order of the quant files, TPM
+            # values are sorted by name
+            self.assertEqual(self.output('counts', 'transcripts'), ['s1\ts2', 't2\t3\t8', 't1\t0\t1'])
+            self.assertEqual(self.output('tpm', 'transcripts'), ['s1\ts2', 't1\t0\t2.25', 't2\t10.5\t1'])
+            self.assertEqual(self.output('counts', 'genes'), ['s1\ts2', 'g1\t3\t9'])
+            self.assertEqual(self.output('tpm', 'genes'), ['s1\ts2', 'g1\t10.5\t3.25'])
+
+    def test_mismatched_quant_files(self):
+        self.add_sample('s1', [('t1', 1, 1), ('t2', 1, 1)], [('g1', 1, 1)])
+        self.add_sample('s2', [('t2', 1, 1), ('t1', 1, 1)], [('g1', 1, 1)])
+        with self.assertRaises(Exception):
+            counts_matrix_from_SALMON.collate(self.salmon_dir, ['s1', 's2'], self.counts_dir, 10)
+        self.add_sample('s2', [('t1', 1, 1)], [('g1', 1, 1)])
+        with self.assertRaises(Exception):
+            counts_matrix_from_SALMON.collate(self.salmon_dir, ['s1', 's2'], self.counts_dir, 10)
+
+    def test_no_samples(self):
+        with self.assertRaises(Exception):
+            counts_matrix_from_SALMON.collate(self.salmon_dir, [], self.counts_dir, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
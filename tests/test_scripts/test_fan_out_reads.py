@@ -0,0 +1,122 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/fan_out_reads.py."""
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+
+SCRIPTS_DIR = os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import fan_out_reads
+
+def record(i, mate):
+    return '@read{}/{}\n{}\n+\n{}\n'.format(i, mate, 'ACGT' * 20, 'I' * 80).encode()
+
+def read_pipes(paths, results):
+    """Open the pipes at PATHS, like STAR and SALMON open the files of
+both mates, then read them one after the other, each to its end."""
+    infiles = [open(path, 'rb') for path in paths]
+    for path, infile in zip(paths, infiles):
+        results[path] = infile.read()
+        infile.close()
+
+class FanOutReadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_fan_out.')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def pipes(self, *names):
+        paths = [os.path.join(self.folder, name) for name in names]
+        for path in paths:
+            os.mkfifo(path)
+        return paths
+
+    def test_split_mates(self):
+        pairs = 5
+        text = b''.join(record(i, 1) + record(i, 2) for i in range(pairs))
+        for size in [1, 7, 100, len(text)]:
+            splitter = fan_out_reads.MateSplitter(2)
+            mates = [b'', b'']
+            for start in range(0, len(text), size):
+                for m, part in enumerate(splitter.split(text[start:start + size])):
+                    mates[m] += part
+            splitter.finish()
+            self.assertEqual(mates, [b''.join(record(i, m) for i in range(pairs)) for m in [1, 2]])
+
+    def test_incomplete_pair(self):
+        splitter = fan_out_reads.MateSplitter(2)
+        splitter.split(record(0, 1) + record(0, 2) + record(1, 1))
+        with self.assertRaises(Exception):
+            splitter.finish()
+
+    def test_readers_taking_one_mate_first(self):
+        # Each mate is far larger than a pipe buffer, and the readers
+        # read their pipes in opposite orders.
+        pairs = 5000
+        star = self.pipes('star_R1', 'star_R2')
+        salmon = self.pipes('salmon_R1', 'salmon_R2')
+        keep = [os.path.join(self.folder, 'kept_R{}.fastq.gz'.format(m)) for m in [1, 2]]
+        results = {}
+        readers = [threading.Thread(target=read_pipes, args=(star, results)),
+                   threading.Thread(target=read_pipes, args=(salmon[::-1], results))]
+        for reader in readers:
+            reader.start()
+        process = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, 'fan_out_reads.py'),
+                                    '-1', star[0], salmon[0], '-2', star[1], salmon[1],
+                                    '--keep1', keep[0], '--keep2', keep[1], '--buffer-mb', '16'],
+                                   stdin=subprocess.PIPE)
+        process.communicate(b''.join(record(i, 1) + record(i, 2) for i in range(pairs)), timeout=60)
+        self.assertEqual(process.returncode, 0)
+        for reader in readers:
+            reader.join(60)
+        for m in [1, 2]:
+            expected = b''.join(record(i, m) for i in range(pairs))
+            self.assertEqual(results[star[m - 1]], expected)
+            self.assertEqual(results[salmon[m - 1]], expected)
+            with gzip.open(keep[m - 1], 'rb') as infile:
+                self.assertEqual(infile.read(), expected)
+
+    def test_reader_exiting_early(self):
+        pipe, = self.pipes('star_R1')
+        def read_some():
+            with open(pipe, 'rb') as infile:
+                infile.read(100)
+        reader = threading.Thread(target=read_some)
+        reader.start()
+        process = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, 'fan_out_reads.py'), '-1', pipe],
+                                   stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            process.communicate(b''.join(record(i, 1) for i in range(5000)), timeout=60)
+        except BrokenPipeError:
+            process.wait(60)
+        reader.join(60)
+        self.assertNotEqual(process.returncode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/index_cache.py."""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+import subprocess
+
+SCRIPTS_DIR = os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import index_cache
+
+# Build command writing its last argument to the file SA in {index_dir}.
+BUILD = [sys.executable, '-c',
+         'import os, sys; open(os.path.join(sys.argv[1], "SA"), "w").write(sys.argv[2])',
+         '{index_dir}']
+
+class IndexCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_index_cache.')
+        self.cache_dir = os.path.join(self.folder, 'cache with space')
+        os.makedirs(self.cache_dir)
+        self.genome = os.path.join(self.folder, "genome 'a'.fa")
+        with open(self.genome, 'w') as outfile:
+            outfile.write('>chr1\nACGT\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_file_checksum(self):
+        checksum = index_cache.file_checksum(self.genome, self.cache_dir)
+        self.assertEqual(checksum, hashlib.sha256(b'>chr1\nACGT\n').hexdigest())
+        with open(os.path.join(self.cache_dir, 'checksums.json'), 'r') as infile:
+            self.assertEqual(list(json.load(infile).values()), [checksum])
+        # served from the cache while size and mtime are unchanged
+        stat = os.stat(self.genome)
+        with open(self.genome, 'w') as outfile:
+            outfile.write('>chr2\nTGCA\n')
+        os.utime(self.genome, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(index_cache.file_checksum(self.genome, self.cache_dir), checksum)
+        os.utime(self.genome, (0, 0))
+        self.assertEqual(index_cache.file_checksum(self.genome, self.cache_dir),
+                         hashlib.sha256(b'>chr2\nTGCA\n').hexdigest())
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'checksums.json.tmp')))
+
+    def test_entry_key(self):
+        key = index_cache.entry_key([self.genome], 'echo 1.0', ['--sjdbOverhang 100'], self.cache_dir)
+        self.assertEqual(key, index_cache.entry_key([self.genome], 'echo 1.0', ['--sjdbOverhang 100'], self.cache_dir))
+        self.assertNotEqual(key, index_cache.entry_key([self.genome], 'echo 1.1', ['--sjdbOverhang 100'], self.cache_dir))
+        self.assertNotEqual(key, index_cache.entry_key([self.genome], 'echo 1.0', ['--sjdbOverhang 50'], self.cache_dir))
+        self.assertNotEqual(key, index_cache.entry_key([], 'echo 1.0', ['--sjdbOverhang 100'], self.cache_dir))
+
+    def test_build_or_reuse(self):
+        targets = [os.path.join(self.folder, 'project {}'.format(i), 'star_index') for i in range(2)]
+        index_cache.build_or_reuse(self.cache_dir, 'star_index', targets[0], 'a' * 64, BUILD + ['first'])
+        # the second project reuses the entry instead of building again
+        index_cache.build_or_reuse(self.cache_dir, 'star_index', targets[1], 'a' * 64, BUILD + ['second'])
+        for target in targets:
+            self.assertTrue(os.path.islink(os.path.join(target, 'SA')))
+            with open(os.path.join(target, 'SA'), 'r') as infile:
+                self.assertEqual(infile.read(), 'first')
+        self.assertEqual(os.listdir(targets[0]), ['SA'])
+        # a different key is a different entry
+        index_cache.build_or_reuse(self.cache_dir, 'star_index', targets[1], 'b' * 64, BUILD + ['third'])
+        with open(os.path.join(targets[1], 'SA'), 'r') as infile:
+            self.assertEqual(infile.read(), 'third')
+
+    def test_failed_build(self):
+        with self.assertRaises(Exception):
+            index_cache.build_or_reuse(self.cache_dir, 'star_index', os.path.join(self.folder, 'target'),
+                                       'c' * 64, [sys.executable, '-c', 'import sys; sys.exit(3)'])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['star_index-cccccccccccccccc.lock'])
+
+    def test_command_line(self):
+        target = os.path.join(self.folder, 'target')
+        subprocess.check_call([sys.executable, os.path.join(SCRIPTS_DIR, 'index_cache.py'),
+                               '--cache-dir', self.cache_dir, '--name', 'salmon_index',
+                               '--target', target, '--key-file', self.genome,
+                               '--key-string', "-k 31 --type 'puff'", '--'] + BUILD + ["it's built"],
+                              stdout=subprocess.DEVNULL)
+        with open(os.path.join(target, 'SA'), 'r') as infile:
+            self.assertEqual(infile.read(), "it's built")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/resource_profiles.py."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts'))
+
+import resource_profiles
+
+def write_benchmark(path, rss, seconds=10.0, cpu_time=None, mean_load=None):
+    """Write a benchmark file like Snakemake's "benchmark:" directive."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = ['s', 'h:m:s', 'max_rss', 'max_vms', 'max_uss', 'max_pss', 'io_in', 'io_out', 'mean_load']
+    values = [seconds, '0:00:10', rss, 0, 0, 0, 0, 0, mean_load if mean_load is not None else 'NA']
+    if cpu_time is not None:
+        header.append('cpu_time')
+        values.append(cpu_time)
+    with open(path, 'w') as outfile:
+        outfile.write('\t'.join(header) + '\n')
+        outfile.write('\t'.join(str(v) for v in values) + '\n')
+
+def observations(profiles, rule):
+    """Return the observations of RULE without their finishing times."""
+    return [observation[:4] for observation in profiles[rule].values()]
+
+class ResourceProfilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_profiles.')
+        self.benchmark_dir = os.path.join(self.folder, 'benchmarks')
+        self.profiles = os.path.join(self.folder, 'shared', 'profiles.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_memory_mb(self):
+        self.assertEqual([resource_profiles.memory_mb(size) for size in ['16G', '512m', ' 2048K ', '1.5T', 2 ** 30]],
+                         [16384, 512, 2, 1572864, 1024])
+
+    def test_update_profiles(self):
+        write_benchmark(os.path.join(self.benchmark_dir, 'star_map', 's1.tsv'), 1000, cpu_time=35)
+        write_benchmark(os.path.join(self.benchmark_dir, 'star_map', 's2.tsv'), 'NA')
+        write_benchmark(os.path.join(self.benchmark_dir, 'salmon_quant', 's1.tsv'), 200, mean_load=250)
+        write_benchmark(os.path.join(self.benchmark_dir, 'multiqc.tsv'), 300)
+        sizes = {'s1': 10, 's2': 20, '-': 30}
+        profiles = resource_profiles.update_profiles(self.profiles, self.benchmark_dir,
+                                                     lambda rule, target: sizes[target])
+        self.assertEqual(profiles, resource_profiles.read_profiles(self.profiles))
+        self.assertEqual(sorted(profiles), ['multiqc', 'salmon_quant', 'star_map'])
+        # jobs without a memory record are left out
+        self.assertEqual(observations(profiles, 'star_map'), [[10, 1000.0, 35.0, 10.0]])
+        # CPU time is estimated from the load when it is not recorded
+        self.assertEqual(observations(profiles, 'salmon_quant'), [[10, 200.0, 25.0, 10.0]])
+        self.assertEqual(observations(profiles, 'multiqc'), [[30, 300.0, None, 10.0]])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.profiles))), ['profiles.json', 'profiles.json.lock'])
+
+    def test_update_profiles_skips_unknown_targets(self):
+        write_benchmark(os.path.join(self.benchmark_dir, 'star_map', 's1.tsv'), 1000)
+        write_benchmark(os.path.join(self.benchmark_dir, 'star_map', 'removed.tsv'), 2000)
+        write_benchmark(os.path.join(self.benchmark_dir, 'star_index.tsv'), 3000)
+        profiles = resource_profiles.update_profiles(self.profiles, self.benchmark_dir,
+                                                     lambda rule, target: {'s1': 10}.get(target))
+        self.assertEqual(sorted(profiles), ['star_map'])
+        self.assertEqual(observations(profiles, 'star_map'), [[10, 1000.0, None, 10.0]])
+
+    def test_update_profiles_replaces_and_skips(self):
+        benchmark = os.path.join(self.benchmark_dir, 'star_map', 's1.tsv')
+        write_benchmark(benchmark, 1000)
+        write_benchmark(os.path.join(self.benchmark_dir, 'trim_map_quant', 's1.tsv'), 5000)
+        resource_profiles.update_profiles(self.profiles, self.benchmark_dir, lambda rule, target: 1)
+        write_benchmark(benchmark, 1500)
+        profiles = resource_profiles.update_profiles(self.profiles, self.benchmark_dir, lambda rule, target: 2,
+                                                     skip_rules=['trim_map_quant'])
+        self.assertEqual(observations(profiles, 'star_map'), [[2, 1500.0, None, 10.0]])
+        # earlier observations of skipped rules are kept
+        self.assertEqual(observations(profiles, 'trim_map_quant'), [[1, 5000.0, None, 10.0]])
+
+    def test_update_profiles_keeps_recent_observations(self):
+        for i in range(5):
+            benchmark = os.path.join(self.benchmark_dir, 'fastqc', 's{}.tsv'.format(i))
+            write_benchmark(benchmark, 100 + i)
+            os.utime(benchmark, (1000 + i, 1000 + i))
+            profiles = resource_profiles.update_profiles(self.profiles, self.benchmark_dir,
+                                                         lambda rule, target: 1, max_observations=3)
+        self.assertEqual(sorted(o[1] for o in profiles['fastqc'].values()), [102.0, 103.0, 104.0])
+        # observations written before finishing times were recorded are
+        # the first to go
+        profiles['fastqc']['old'] = [1, 99.0, None, 1.0]
+        with open(self.profiles, 'w') as outfile:
+            json.dump(profiles, outfile)
+        profiles = resource_profiles.update_profiles(self.profiles, self.benchmark_dir,
+                                                     lambda rule, target: 1, max_observations=3)
+        self.assertEqual(sorted(o[1] for o in profiles['fastqc'].values()), [102.0, 103.0, 104.0])
+
+    def test_read_profiles(self):
+        self.assertEqual(resource_profiles.read_profiles(self.profiles), {})
+        self.assertEqual(resource_profiles.read_profiles(''), {})
+        os.makedirs(os.path.dirname(self.profiles))
+        with open(self.profiles, 'w') as outfile:
+            outfile.write('{"truncated": ')
+        self.assertEqual(resource_profiles.read_profiles(self.profiles), {})
+
+    def test_predict_memory(self):
+        profiles = {'star_map': {'a': [1000, 2000, None, None],
+                                 'b': [2000, 3000, None, None],
+                                 'c': [3000, 4000, None, None]}}
+        # exact linear fit: 1000 + size, plus the margin
+        self.assertEqual(resource_profiles.predict_memory(profiles, 'star_map', 4000, margin=0), 5001)
+        self.assertEqual(resource_profiles.predict_memory(profiles, 'star_map', 4000), 6001)
+        self.assertIsNone(resource_profiles.predict_memory(profiles, 'star_map', 4000, min_observations=4))
+        self.assertIsNone(resource_profiles.predict_memory(profiles, 'salmon_quant', 4000))
+
+    def test_predict_memory_covers_observations(self):
+        profiles = {'sort_bam': {'a': [1000, 500, None, None],
+                                 'b': [1000, 1500, None, None],
+                                 'c': [2000, 1000, None, None]}}
+        # the fit never predicts less than was observed, and memory never
+        # decreases with the input size
+        for size, rss in [(1000, 1500), (2000, 1000)]:
+            self.assertGreaterEqual(resource_profiles.predict_memory(profiles, 'sort_bam', size, margin=0), rss)
+        self.assertGreaterEqual(resource_profiles.predict_memory(profiles, 'sort_bam', 2000, margin=0),
+                                resource_profiles.predict_memory(profiles, 'sort_bam', 1000, margin=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# PiGx RNAseq Pipeline.
+#
+# This file is part of the PiGx RNAseq Pipeline.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests of scripts/summarize_benchmarks.py."""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+SCRIPTS_DIR = os.path.join(os.getenv('srcdir') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'), 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import summarize_benchmarks
+
+HEADER = 's\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load'
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write(text)
+    return path
+
+class SummarizeBenchmarksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='pigx_test_benchmarks.')
+        self.benchmark_dir = os.path.join(self.folder, 'benchmarks')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_number(self):
+        self.assertEqual(summarize_benchmarks.number('1.5'), 1.5)
+        for value in ['NA', '-', '', None]:
+            self.assertIsNone(summarize_benchmarks.number(value))
+
+    def test_read_benchmark(self):
+        path = write_file(os.path.join(self.folder, 'a.tsv'),
+                          HEADER + '\tcpu_time\n' +
+                          '99\t0:01:39\t1\t2\t3\t4\t5\t6\t7\t8\n' +
+                          '12.5\t0:00:12\t1024.5\t2048\t1000\t1000\t10.0\t20.0\t150\t30.25\n')
+        # the last record counts when a job was repeated
+        self.assertEqual(summarize_benchmarks.read_benchmark(path),
+                         {'wall_seconds': 12.5, 'cpu_seconds': 30.25, 'max_rss_mb': 1024.5,
+                          'io_in_mb': 10.0, 'io_out_mb': 20.0})
+
+    def test_read_benchmark_without_cpu_time(self):
+        path = write_file(os.path.join(self.folder, 'a.tsv'),
+                          HEADER + '\n20\t0:00:20\t100\t200\t90\t90\t1\t2\t250\n')
+        self.assertEqual(summarize_benchmarks.read_benchmark(path)['cpu_seconds'], 50.0)
+        path = write_file(os.path.join(self.folder, 'b.tsv'),
+                          HEADER + '\n0.01\t0:00:00\t-\t-\t-\t-\t-\t-\tNA\n')
+        self.assertEqual(summarize_benchmarks.read_benchmark(path),
+                         {'wall_seconds': 0.01, 'cpu_seconds': None, 'max_rss_mb': None,
+                          'io_in_mb': None, 'io_out_mb': None})
+
+    def test_read_empty_or_partial_benchmark(self):
+        self.assertIsNone(summarize_benchmarks.read_benchmark(write_file(os.path.join(self.folder, 'a.tsv'), '')))
+        self.assertIsNone(summarize_benchmarks.read_benchmark(write_file(os.path.join(self.folder, 'b.tsv'), HEADER + '\n')))
+        # a record cut short while it was written
+        record = summarize_benchmarks.read_benchmark(write_file(os.path.join(self.folder, 'c.tsv'),
+                                                                HEADER + '\n3.0\t0:00:03\t'))
+        self.assertEqual(record['wall_seconds'], 3.0)
+        self.assertIsNone(record['max_rss_mb'])
+
+    def test_collect(self):
+        write_file(os.path.join(self.benchmark_dir, 'star_map', 's2.tsv'), HEADER + '\n2\t-\t20\t-\t-\t-\t-\t-\t100\n')
+        write_file(os.path.join(self.benchmark_dir, 'star_map', 's1.tsv'), HEADER + '\n1\t-\t10\t-\t-\t-\t-\t-\t100\n')
+        write_file(os.path.join(self.benchmark_dir, 'star_map', 's3.tsv'), '')
+        write_file(os.path.join(self.benchmark_dir, 'star_map', 'notes.txt'), 'ignored\n')
+        write_file(os.path.join(self.benchmark_dir, 'multiqc.tsv'), HEADER + '\n3\t-\t30\t-\t-\t-\t-\t-\t100\n')
+        records = summarize_benchmarks.collect(self.benchmark_dir)
+        self.assertEqual([(r['rule'], r['target'], r['max_rss_mb']) for r in records],
+                         [('multiqc', '-', 30.0), ('star_map', 's1', 10.0), ('star_map', 's2', 20.0)])
+        self.assertEqual(records[1]['path'], os.path.join(os.path.abspath(self.benchmark_dir), 'star_map', 's1.tsv'))
+
+    def test_summarize_rules(self):
+        records = [{'rule': 'a', 'target': 's1', 'wall_seconds': 10.0, 'cpu_seconds': 20.0,
+                    'max_rss_mb': 100.0, 'io_in_mb': 1.0, 'io_out_mb': None},
+                   {'rule': 'a', 'target': 's2', 'wall_seconds': 30.0, 'cpu_seconds': None,
+                    'max_rss_mb': None, 'io_in_mb': 2.0, 'io_out_mb': 4.0},
+                   {'rule': 'b', 'target': '-', 'wall_seconds': None, 'cpu_seconds': 5.0,
+                    'max_rss_mb': 300.0, 'io_in_mb': None, 'io_out_mb': None}]
+        rules = summarize_benchmarks.summarize_rules(records)
+        # sorted by total wall time, missing values count as 0
+        self.assertEqual(rules, [
+            {'rule': 'a', 'jobs': 2, 'total_wall_seconds': 40.0, 'total_cpu_seconds': 20.0,
+             'max_wall_seconds': 30.0, 'max_rss_mb': 100.0, 'total_io_in_mb': 3.0, 'total_io_out_mb': 4.0},
+            {'rule': 'b', 'jobs': 1, 'total_wall_seconds': 0.0, 'total_cpu_seconds': 5.0,
+             'max_wall_seconds': 0.0, 'max_rss_mb': 300.0, 'total_io_in_mb': 0.0, 'total_io_out_mb': 0.0}])
+        self.assertEqual(summarize_benchmarks.summarize_rules([]), [])
+
+    def test_command_line(self):
+        write_file(os.path.join(self.benchmark_dir, 'fastqc', 's1.tsv'), HEADER + '\n4\t-\t40\t-\t-\t-\t-\t-\t100\n')
+        out_dir = os.path.join(self.folder, 'performance')
+        subprocess.check_call([sys.executable, os.path.join(SCRIPTS_DIR, 'summarize_benchmarks.py'),
+                               self.benchmark_dir, out_dir], stdout=subprocess.DEVNULL)
+        with open(os.path.join(out_dir, 'performance_jobs.tsv'), 'r') as infile:
+            self.assertEqual(infile.read().splitlines(),
+                             ['\t'.join(summarize_benchmarks.FIELDS),
+                              'fastqc\ts1\t4.00\t4.00\t40.00\tNA\tNA'])
+        self.assertTrue(os.path.isfile(os.path.join(out_dir, 'performance_report.html')))
+        # an empty benchmark folder still gives a report
+        subprocess.check_call([sys.executable, os.path.join(SCRIPTS_DIR, 'summarize_benchmarks.py'),
+                               os.path.join(self.folder, 'none'), out_dir], stdout=subprocess.DEVNULL)
+
+
+if __name__ == '__main__':
+    unittest.main()